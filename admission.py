@@ -0,0 +1,185 @@
+"""
+Deadline-aware admission control for /api/query.
+A fixed number of queries run at once; the rest wait in a bounded priority
+queue (interactive before batch). A request is rejected up front when the
+queue is full or its expected wait would exceed its deadline, and a queued
+request is dropped once its deadline passes or its client disconnects.
+"""
+import heapq
+import itertools
+import math
+import select
+import socket
+import threading
+import time
+from typing import Callable, Optional
+
+# Priority classes, most urgent first
+PRIORITIES = {'interactive': 0, 'batch': 1}
+
+# How often queued requests re-check their deadline and client connection
+POLL_INTERVAL = 0.1
+
+
+class Rejected(Exception):
+    """The request was shed; the client should retry after retry_after seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Cancelled(Exception):
+    """The request's client disconnected while it was queued."""
+
+
+class _Waiter:
+    __slots__ = ('priority', 'seq', 'admitted')
+
+    def __init__(self, priority: int, seq: int):
+        self.priority = priority
+        self.seq = seq
+        self.admitted = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded, deadline-aware priority queue."""
+
+    def __init__(self, max_concurrent: int, max_queue: int):
+        """
+        Args:
+            max_concurrent: Queries allowed to run at once (0 disables admission control)
+            max_queue: Queries allowed to wait for a slot
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.running = 0
+        self._queue = []
+        self._seq = itertools.count()
+        # Exponentially weighted average of query service time, seconds
+        self._service_time = None
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    def queued(self) -> int:
+        with self._cond:
+            return sum(1 for w in self._queue if not w.admitted)
+
+    def _expected_wait(self, priority: int) -> float:
+        """Estimated queueing delay for a new request of this priority; caller holds the lock."""
+        if self.running < self.max_concurrent or self._service_time is None:
+            return 0.0
+        ahead = sum(1 for w in self._queue if not w.admitted and w.priority <= priority)
+        return (ahead + 1) * self._service_time / self.max_concurrent
+
+    def _admit_next(self):
+        """Hand free slots to the most urgent waiters; caller holds the lock."""
+        while self._queue and self.running < self.max_concurrent:
+            waiter = heapq.heappop(self._queue)
+            waiter.admitted = True
+            self.running += 1
+        self._cond.notify_all()
+
+    def acquire(self, priority: str, deadline: float,
+                is_cancelled: Optional[Callable[[], bool]] = None):
+        """
+        Wait for a slot.
+
+        Args:
+            priority: 'interactive' or 'batch'
+            deadline: time.monotonic() by which the answer is no longer useful
+            is_cancelled: Returns True once the client has gone away
+
+        Raises:
+            Rejected: Deadline already passed, queue full, expected wait past
+                the deadline, or deadline passed while queued
+            Cancelled: is_cancelled() became true while queued
+        """
+        level = PRIORITIES[priority]
+        with self._cond:
+            if deadline <= time.monotonic():
+                # Nobody is waiting for the answer any more; do not spend a slot on it
+                raise Rejected('deadline already passed', 0)
+            if self.running < self.max_concurrent and not self._queue:
+                self.running += 1
+                return
+
+            wait = self._expected_wait(level)
+            if len(self._queue) >= self.max_queue:
+                raise Rejected('admission queue full', max(wait, self._service_time or 1.0))
+            if time.monotonic() + wait > deadline:
+                raise Rejected('expected queue wait exceeds deadline', wait)
+
+            waiter = _Waiter(level, next(self._seq))
+            heapq.heappush(self._queue, waiter)
+            try:
+                while not waiter.admitted:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Rejected('deadline passed while queued', self._expected_wait(level))
+                    if is_cancelled is not None and is_cancelled():
+                        raise Cancelled('client disconnected while queued')
+                    self._cond.wait(min(remaining, POLL_INTERVAL))
+            except BaseException:
+                if waiter.admitted:
+                    # Admitted between the last check and the exception
+                    self.running -= 1
+                    self._admit_next()
+                else:
+                    self._queue.remove(waiter)
+                    heapq.heapify(self._queue)
+                raise
+
+    def release(self, service_time: float):
+        """Free a slot and record how long the query held it."""
+        with self._cond:
+            self.running -= 1
+            if self._service_time is None:
+                self._service_time = service_time
+            else:
+                self._service_time = 0.8 * self._service_time + 0.2 * service_time
+            self._admit_next()
+
+    def run(self, fn: Callable, priority: str, deadline: float,
+            is_cancelled: Optional[Callable[[], bool]] = None):
+        """Run fn once admitted, releasing the slot afterwards."""
+        if not self.enabled:
+            return fn()
+        self.acquire(priority, deadline, is_cancelled)
+        start = time.monotonic()
+        try:
+            return fn()
+        finally:
+            self.release(time.monotonic() - start)
+
+
+def retry_after_header(seconds: float) -> str:
+    """Format a Retry-After value (whole seconds, at least 1)."""
+    return str(max(1, math.ceil(seconds)))
+
+
+def client_disconnected(environ) -> bool:
+    """
+    Check whether the client socket behind a WSGI request has closed.
+
+    Works with the werkzeug development server and gunicorn, which expose the
+    connection in the environ; other servers are assumed to stay connected.
+    """
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        # Readable with no data means the peer closed the connection
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
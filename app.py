@@ -2,49 +2,129 @@
 Main Flask application for Google Drive to Gemini connector.
 Provides a web interface and API for querying documents via Gemini.
 """
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Blueprint, request, jsonify, render_template_string, Response
 from drive_connector import DriveConnector
 from gemini_connector import GeminiConnector
 from rag_processor import RAGProcessor
-from config import DRIVE_FOLDER_ID
+from config import (
+    DRIVE_FOLDER_ID, USE_FAKE_BACKENDS, FAKE_CORPUS_SIZE,
+    FAKE_DRIVE_LATENCY_MS, FAKE_GEMINI_LATENCY_MS,
+    ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE,
+    INTERACTIVE_DEADLINE_SECONDS, BATCH_DEADLINE_SECONDS, MAP_REDUCE_MAX_CHUNKS,
+    PROFILING_ENABLED, ADMIN_TOKEN, PROFILE_INGEST_DIR
+)
+from admission import (
+    AdmissionController, Rejected, Cancelled, PRIORITIES,
+    client_disconnected, retry_after_header
+)
+from metrics import timed, record_cache, render_latest, CONTENT_TYPE_LATEST, QUERIES
+from profiling import ProfileSession, active_session
+from single_flight import SingleFlight
+from startup_profile import maybe_profile_startup
+import gc
+import hmac
+import json
+import math
 import os
+import time
 
-app = Flask(__name__)
+bp = Blueprint('connector', __name__)
 
-# Global instances
+# Global instances (built once per process; shared copy-on-write by forked workers)
 drive_connector = None
 gemini_connector = None
 rag_processor = None
+# Identical queries in flight at the same time share one Gemini call
+query_flight = SingleFlight()
+# Bounds concurrent Gemini work and sheds queries that would miss their deadline
+admission = AdmissionController(ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE)
+# Set once create_app(preload=True) has registered reset_clients_after_fork
+_fork_hook_registered = False
+DEFAULT_DEADLINES = {'interactive': INTERACTIVE_DEADLINE_SECONDS, 'batch': BATCH_DEADLINE_SECONDS}
 
 
 def initialize_connectors(folder_id: str = None):
     """Initialize all connectors with the specified folder ID."""
+    if PROFILE_INGEST_DIR and active_session() is None:
+        session = ProfileSession()
+        try:
+            return session.run(lambda: _initialize_connectors(folder_id))
+        finally:
+            _write_profile(session, 'ingest', PROFILE_INGEST_DIR)
+    return _initialize_connectors(folder_id)
+
+
+def _write_profile(session: ProfileSession, target: str, directory: str):
+    """Write a session's folded stacks and JSON report to directory."""
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"{target}-{time.strftime('%Y%m%d-%H%M%S')}")
+    report = session.report(target)
+    with open(base + '.folded', 'w') as f:
+        f.write(report.pop('folded'))
+    with open(base + '.json', 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Profile written to {base}.folded and {base}.json")
+
+
+def _initialize_connectors(folder_id: str = None):
+    """Build the connectors and load documents (see initialize_connectors)."""
     global drive_connector, gemini_connector, rag_processor
+    previous_gemini = gemini_connector
+    previous_version = rag_processor.corpus_version if rag_processor else None
     
-    folder_id = folder_id or DRIVE_FOLDER_ID
-    
-    if folder_id == 'YOUR_FOLDER_ID_HERE':
-        raise ValueError(
-            "DRIVE_FOLDER_ID not set. Please set it in .env file or config.py"
-        )
-    
-    print("Initializing Google Drive connector...")
-    drive_connector = DriveConnector(folder_id)
-    
-    print("Initializing Google Gemini connector...")
-    gemini_connector = GeminiConnector()
+    if USE_FAKE_BACKENDS:
+        drive_connector, gemini_connector = _create_fake_connectors()
+    else:
+        folder_id = folder_id or DRIVE_FOLDER_ID
+        
+        if folder_id == 'YOUR_FOLDER_ID_HERE':
+            raise ValueError(
+                "DRIVE_FOLDER_ID not set. Please set it in .env file or config.py"
+            )
+        
+        # Reuse the authenticated connector (and its cache of unchanged files) on reload
+        if drive_connector is None or drive_connector.folder_id != folder_id:
+            print("Initializing Google Drive connector...")
+            drive_connector = DriveConnector(folder_id)
+        
+        # Reuse the Gemini connector too, keeping its map cache and latency history
+        if gemini_connector is None:
+            print("Initializing Google Gemini connector...")
+            gemini_connector = GeminiConnector()
     
     print("Loading documents from Google Drive...")
-    documents = drive_connector.get_all_documents()
+    with timed('ingest'):
+        documents = drive_connector.get_all_documents()
     
     print("Processing documents for RAG...")
     rag_processor = RAGProcessor()
     rag_processor.load_documents(documents)
     
+    # Delete the server-side cached corpus of the previous load rather than
+    # leaving it billed until its TTL expires
+    if previous_gemini is not None and (
+            previous_gemini is not gemini_connector or rag_processor.corpus_version != previous_version):
+        previous_gemini.context_cache.invalidate()
+    
     print("✓ All connectors initialized successfully!")
     return True
 
 
+def _create_fake_connectors():
+    """Build Drive and Gemini connectors backed by offline fakes."""
+    from fake_backends import (
+        SyntheticCorpus, FakeDriveHttp, FakeGenerativeModel,
+        build_fake_drive_service, FAKE_FOLDER_ID
+    )
+    
+    print(f"Using fake backends with a synthetic corpus of {FAKE_CORPUS_SIZE} files...")
+    corpus = SyntheticCorpus(FAKE_CORPUS_SIZE)
+    http = FakeDriveHttp(corpus, latency_ms=FAKE_DRIVE_LATENCY_MS)
+    drive = DriveConnector(FAKE_FOLDER_ID, service=build_fake_drive_service(http))
+    gemini = GeminiConnector(model=FakeGenerativeModel(latency_ms=FAKE_GEMINI_LATENCY_MS))
+    return drive, gemini
+
+
 # HTML template for the web interface
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -209,18 +289,9 @@ HTML_TEMPLATE = """
 """
 
 
-@app.route('/')
+@bp.route('/')
 def index():
     """Render the main web interface."""
-    # Try to initialize if not already done
-    global rag_processor
-    if rag_processor is None:
-        try:
-            initialize_connectors()
-        except Exception as e:
-            # Still show the page but with error info
-            pass
-    
     doc_count = len(rag_processor.documents) if rag_processor else 0
     return render_template_string(
         HTML_TEMPLATE,
@@ -229,45 +300,116 @@ def index():
     )
 
 
-@app.route('/api/query', methods=['POST'])
+@bp.route('/api/query', methods=['POST'])
 def query():
     """API endpoint for querying documents via Gemini."""
     if not gemini_connector or not rag_processor:
-        # Try to initialize if not already done
-        try:
-            initialize_connectors()
-        except Exception as e:
-            return jsonify({
-                'error': f'Connectors not initialized. Initialization failed: {str(e)}. Please check the terminal/console for details.'
-            }), 500
+        # Documents are loaded at startup, never on a user request
+        return jsonify({
+            'error': 'Connectors not initialized. Check the terminal/console for startup errors, then POST /api/reload.'
+        }), 503
     
     data = request.get_json()
     user_query = data.get('query', '')
+    # 'rag' answers from the top chunks; 'map_reduce' reads every chunk
+    mode = data.get('mode', 'rag')
+    # Batch callers yield to interactive ones and may wait longer
+    priority = data.get('priority', 'interactive')
     
     if not user_query:
+        QUERIES.inc(outcome='rejected')
         return jsonify({'error': 'Query is required'}), 400
+    if mode not in ('rag', 'map_reduce'):
+        QUERIES.inc(outcome='rejected')
+        return jsonify({'error': "mode must be 'rag' or 'map_reduce'"}), 400
+    if priority not in PRIORITIES:
+        QUERIES.inc(outcome='rejected')
+        return jsonify({'error': "priority must be 'interactive' or 'batch'"}), 400
+    try:
+        deadline_ms = float(data.get('deadline_ms', DEFAULT_DEADLINES[priority] * 1000))
+    except (TypeError, ValueError):
+        deadline_ms = float('nan')
+    if not math.isfinite(deadline_ms) or deadline_ms <= 0:
+        QUERIES.inc(outcome='rejected')
+        return jsonify({'error': 'deadline_ms must be a positive number'}), 400
+    # No caller waits longer than the batch default
+    deadline = time.monotonic() + min(deadline_ms / 1000, BATCH_DEADLINE_SECONDS)
     
+    environ = request.environ
     try:
-        # Retrieve relevant context from documents
-        context = rag_processor.retrieve_relevant_chunks(user_query, top_k=5)
-        
-        # If no context found, use all content (for small document sets)
-        if not context.strip():
-            context = rag_processor.get_all_content()
-            # Still truncate if too long
-            if len(context) > 30000:
-                context = context[:30000] + "... [truncated]"
-        
-        # Query Gemini with context
-        response = gemini_connector.query_with_context(user_query, context)
+        with timed('query_total'):
+            # Capture the current corpus and model so a reload cannot mix generations.
+            # Priority is part of the key so interactive queries never wait in
+            # the batch queue behind a coalesced batch caller.
+            rag, gemini = rag_processor, gemini_connector
+            key = (' '.join(user_query.lower().split()), mode, priority, rag.corpus_version, gemini.model_name)
+            led = []
+            
+            def run():
+                # Only the request that actually calls Gemini takes an admission slot
+                led.append(True)
+                return admission.run(
+                    lambda: _answer(rag, gemini, user_query, mode, deadline),
+                    priority, deadline, lambda: client_disconnected(environ)
+                )
+            
+            while True:
+                try:
+                    # Callers sharing another request's call still keep their own deadline
+                    response, shared = query_flight.do(key, run, timeout=max(deadline - time.monotonic(), 0))
+                    break
+                except TimeoutError:
+                    if led:
+                        raise
+                    raise Rejected('deadline passed while waiting for an identical query', 0)
+                except Cancelled:
+                    # The shared call was dropped because its caller left; retry unless we did too
+                    if led or client_disconnected(environ):
+                        raise
+                except Rejected:
+                    # The shared call missed its caller's deadline; retry under ours if time is left
+                    if led or time.monotonic() >= deadline:
+                        raise
+            record_cache('query_single_flight', shared)
         
+        QUERIES.inc(outcome='error' if response.startswith('Error') else 'ok')
         return jsonify({'response': response})
     
+    except Rejected as e:
+        QUERIES.inc(outcome='shed')
+        return jsonify({'error': f'Server busy: {e.reason}. Please retry.'}), 429, {
+            'Retry-After': retry_after_header(e.retry_after)
+        }
+    except Cancelled:
+        QUERIES.inc(outcome='cancelled')
+        return jsonify({'error': 'Client disconnected'}), 499
     except Exception as e:
+        QUERIES.inc(outcome='error')
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/api/reload', methods=['POST'])
+def _answer(rag: RAGProcessor, gemini: GeminiConnector, user_query: str, mode: str,
+            deadline: float = None) -> str:
+    """Run retrieval and generation for one query."""
+    if mode == 'map_reduce':
+        return gemini.query_map_reduce(
+            user_query, rag.map_reduce_chunks(user_query, MAP_REDUCE_MAX_CHUNKS),
+            label=lambda chunk: rag.file_label(chunk['file_ids']),
+            deadline=deadline
+        )
+    
+    # Retrieve relevant context from documents
+    context = rag.retrieve_relevant_chunks(user_query, top_k=5)
+    
+    if context.strip():
+        # Query Gemini with context
+        return gemini.query_with_context(user_query, context)
+    # If no context found, use all content (for small document sets);
+    # the corpus prefix is built and cached once per corpus version
+    return gemini.query_with_corpus(user_query, rag.corpus_version, rag.get_all_content)
+
+
+@bp.route('/api/reload', methods=['POST'])
 def reload():
     """Reload documents from Google Drive."""
     try:
@@ -281,17 +423,171 @@ def reload():
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/api/status', methods=['GET'])
+@bp.route('/api/search', methods=['GET'])
+def search():
+    """Ranked chunk hits for a query, without calling Gemini."""
+    if not rag_processor:
+        return jsonify({
+            'error': 'Connectors not initialized. Check the terminal/console for startup errors, then POST /api/reload.'
+        }), 503
+    
+    user_query = request.args.get('q', '').strip()
+    if not user_query:
+        return jsonify({'error': 'Query parameter q is required'}), 400
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', 10)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
+    
+    results = rag_processor.search(
+        user_query, offset=offset, limit=limit,
+        file_ids=request.args.getlist('file_id'),
+        mime_types=request.args.getlist('mime_type')
+    )
+    return jsonify({
+        'query': user_query,
+        'offset': offset,
+        'limit': limit,
+        'total': results['total'],
+        'hits': results['hits']
+    })
+
+
+@bp.route('/api/status', methods=['GET'])
 def status():
     """Get status of the connector."""
     return jsonify({
         'initialized': rag_processor is not None,
         'document_count': len(rag_processor.documents) if rag_processor else 0,
-        'folder_id': DRIVE_FOLDER_ID
+        'folder_id': DRIVE_FOLDER_ID,
+        'queries_running': admission.running,
+        'queries_queued': admission.queued()
     })
 
 
+@bp.route('/admin/profile', methods=['POST'])
+def admin_profile():
+    """
+    Profile one ingest or one query and return the report.
+    
+    JSON body: {"target": "query" | "ingest", "query": ..., "mode": ...,
+    "folder_id": ..., "memory": true, "interval_ms": 5, "format": "json" | "folded"}
+    """
+    if not PROFILING_ENABLED:
+        return jsonify({'error': 'Not found'}), 404
+    # Profiling can trigger ingests and exposes stacks and allocations, so it is never open
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Profiling requires ADMIN_TOKEN to be set'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    target = data.get('target', 'query')
+    try:
+        interval_ms = float(data.get('interval_ms', 5))
+    except (TypeError, ValueError):
+        interval_ms = float('nan')
+    # NaN fails both comparisons; below 1 ms the sampler would starve the profiled code
+    if not 1 <= interval_ms <= 1000:
+        return jsonify({'error': 'interval_ms must be a number between 1 and 1000'}), 400
+    session = ProfileSession(
+        interval=interval_ms / 1000,
+        memory=bool(data.get('memory', True))
+    )
+    
+    try:
+        if target == 'ingest':
+            session.run(lambda: initialize_connectors(data.get('folder_id')))
+            answer = None
+        elif target == 'query':
+            user_query = data.get('query', '')
+            mode = data.get('mode', 'rag')
+            if not user_query or mode not in ('rag', 'map_reduce'):
+                return jsonify({'error': "query is required and mode must be 'rag' or 'map_reduce'"}), 400
+            if not gemini_connector or not rag_processor:
+                return jsonify({'error': 'Connectors not initialized'}), 503
+            # Bypasses admission control and coalescing so the profile shows the query itself
+            answer = session.run(lambda: _answer(rag_processor, gemini_connector, user_query, mode))
+        else:
+            return jsonify({'error': "target must be 'query' or 'ingest'"}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    if data.get('format') == 'folded':
+        return Response(session.folded(), content_type='text/plain; charset=utf-8')
+    report = session.report(target)
+    if answer is not None:
+        report['response'] = answer
+    return jsonify(report)
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose stage latencies and counters in Prometheus text format."""
+    return Response(render_latest(), content_type=CONTENT_TYPE_LATEST)
+
+
+def create_app(preload: bool = False) -> Flask:
+    """
+    Create the Flask application.
+    
+    Args:
+        preload: Load documents from Google Drive before returning, so the
+            first request never pays the ingest cost. Servers that fork
+            workers should preload in the parent process.
+        
+    Returns:
+        Configured Flask app
+    """
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(bp)
+    
+    if preload:
+        try:
+            initialize_connectors()
+        except Exception as e:
+            print(f"\n❌ Error initializing: {str(e)}\n")
+            print("Please check your configuration, then POST /api/reload.\n")
+        
+        # Move the loaded corpus out of the collector's reach so GC passes in
+        # forked workers do not touch (and un-share) its pages
+        gc.collect()
+        gc.freeze()
+        
+        # Whichever server forks the workers (serve.py, gunicorn --preload
+        # wsgi:application, ...), each worker gets its own network clients
+        global _fork_hook_registered
+        if not _fork_hook_registered and hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=reset_clients_after_fork)
+            _fork_hook_registered = True
+    
+    return flask_app
+
+
+def reset_clients_after_fork():
+    """
+    Rebuild network clients in a freshly forked worker.
+    
+    The corpus and index loaded in the parent are kept and shared
+    copy-on-write; only network clients, whose connections must not be
+    shared across processes, are recreated.
+    """
+    global gemini_connector
+    if drive_connector is not None:
+        drive_connector.reset_clients()
+    if gemini_connector is not None and not USE_FAKE_BACKENDS:
+        gemini_connector = GeminiConnector()
+
+
+app = create_app()
+
+
 if __name__ == '__main__':
+    maybe_profile_startup('app')
+    
     # Initialize connectors on startup
     try:
         initialize_connectors()
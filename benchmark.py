@@ -0,0 +1,216 @@
+"""
+Offline benchmark for ingest and query performance.
+Runs DriveConnector, RAGProcessor and GeminiConnector against fake backends
+over synthetic corpora and reports machine-readable results.
+
+Usage:
+    python benchmark.py --sizes 10,100,1000 --queries 200 --output bench.json
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Dict
+
+from drive_connector import DriveConnector
+from gemini_connector import GeminiConnector
+from rag_processor import RAGProcessor
+from metrics import percentile
+from fake_backends import (
+    SyntheticCorpus, FakeDriveHttp, FakeGenerativeModel, build_fake_drive_service,
+    FAKE_FOLDER_ID, DEFAULT_MIME_MIX
+)
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence per-file progress output during timed sections."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def parse_mime_mix(value: str) -> Dict[str, float]:
+    """Parse 'mime=weight,mime=weight' into a dict."""
+    if not value:
+        return dict(DEFAULT_MIME_MIX)
+    mix = {}
+    for item in value.split(','):
+        mime_type, weight = item.rsplit('=', 1)
+        mix[mime_type.strip()] = float(weight)
+    return mix
+
+
+def _ingest(corpus: SyntheticCorpus, args) -> Dict:
+    """Run ingest and index build once, returning timings and the built objects."""
+    http = FakeDriveHttp(corpus, latency_ms=args.drive_latency_ms)
+    drive = DriveConnector(FAKE_FOLDER_ID, service=build_fake_drive_service(http))
+
+    gc.collect()
+    start = time.perf_counter()
+    with quiet():
+        documents = drive.get_all_documents()
+    ingest_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rag = RAGProcessor()
+    with quiet():
+        rag.load_documents(documents)
+    index_seconds = time.perf_counter() - start
+
+    return {
+        'ingest_seconds': ingest_seconds,
+        'index_build_seconds': index_seconds,
+        'documents': documents,
+        'rag': rag,
+        'drive': drive,
+        'http': http,
+        'http_requests': http.request_count,
+    }
+
+
+def _peak_memory(corpus: SyntheticCorpus, args) -> int:
+    """Measure peak traced memory of ingest plus index build in a separate pass."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        _ingest(corpus, args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_size(size: int, args) -> Dict:
+    """Benchmark one corpus size."""
+    corpus = SyntheticCorpus(
+        size,
+        mime_mix=parse_mime_mix(args.mime_mix),
+        min_size=args.min_size,
+        max_size=args.max_size,
+        duplicate_ratio=args.duplicate_ratio,
+        seed=args.seed,
+    )
+    ingest = _ingest(corpus, args)
+    rag = ingest['rag']
+
+    # Unchanged corpus: listed files whose md5Checksum/modifiedTime match are reused
+    http = ingest['http']
+    requests_before = http.request_count
+    start = time.perf_counter()
+    with quiet():
+        ingest['drive'].get_all_documents()
+    reingest_seconds = time.perf_counter() - start
+    reingest_requests = http.request_count - requests_before
+
+    model = FakeGenerativeModel(
+        latency_ms=args.gemini_latency_ms,
+        per_1k_chars_ms=args.gemini_per_1k_chars_ms,
+    )
+    gemini = GeminiConnector(model=model)
+
+    retrieval_latencies = []
+    search_latencies = []
+    query_latencies = []
+    for query in corpus.sample_queries(args.queries, seed=args.seed):
+        start = time.perf_counter()
+        rag.search(query, limit=10)
+        search_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        context = rag.retrieve_relevant_chunks(query, top_k=5)
+        retrieved = time.perf_counter()
+        if context.strip():
+            gemini.query_with_context(query, context)
+        else:
+            gemini.query_with_corpus(query, rag.corpus_version, rag.get_all_content)
+        done = time.perf_counter()
+        retrieval_latencies.append(retrieved - start)
+        query_latencies.append(done - start)
+
+    result = {
+        'corpus_size': size,
+        'documents_ingested': len(ingest['documents']),
+        'chunks_indexed': len(rag.chunks),
+        'unique_documents': len(rag.content_files),
+        'corpus_chars': sum(len(d['content']) for d in ingest['documents'].values()),
+        'http_requests': ingest['http_requests'],
+        'ingest_seconds': round(ingest['ingest_seconds'], 6),
+        'index_build_seconds': round(ingest['index_build_seconds'], 6),
+        'reingest_seconds': round(reingest_seconds, 6),
+        'reingest_http_requests': reingest_requests,
+        'queries': len(query_latencies),
+        'retrieval_p50_ms': round(percentile(retrieval_latencies, 50) * 1000, 3),
+        'retrieval_p99_ms': round(percentile(retrieval_latencies, 99) * 1000, 3),
+        'search_p50_ms': round(percentile(search_latencies, 50) * 1000, 3),
+        'search_p99_ms': round(percentile(search_latencies, 99) * 1000, 3),
+        'query_p50_ms': round(percentile(query_latencies, 50) * 1000, 3),
+        'query_p99_ms': round(percentile(query_latencies, 99) * 1000, 3),
+        'avg_prompt_chars': round(model.prompt_chars / max(model.call_count, 1), 1),
+    }
+
+    # Free the timed pass before measuring memory so the two do not overlap
+    del ingest, rag, gemini
+    if not args.skip_memory:
+        result['peak_memory_bytes'] = _peak_memory(corpus, args)
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline ingest/query benchmark with fake Drive and Gemini backends.")
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help="Comma-separated corpus sizes (number of files), e.g. 10,1000,100000")
+    parser.add_argument('--queries', type=int, default=100, help="Queries to run per corpus size")
+    parser.add_argument('--min-size', type=int, default=2000, help="Minimum document size in characters")
+    parser.add_argument('--max-size', type=int, default=20000, help="Maximum document size in characters")
+    parser.add_argument('--mime-mix', default='',
+                        help="MIME weights, e.g. 'application/pdf=1,text/plain=3' (default: mixed)")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.0,
+                        help="Fraction of files that are copies of another file")
+    parser.add_argument('--drive-latency-ms', type=float, default=0.0, help="Simulated Drive latency per HTTP request")
+    parser.add_argument('--gemini-latency-ms', type=float, default=0.0, help="Simulated Gemini latency per call")
+    parser.add_argument('--gemini-per-1k-chars-ms', type=float, default=0.0,
+                        help="Simulated Gemini latency per 1,000 prompt characters")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-memory', action='store_true', help="Skip the tracemalloc peak-memory pass")
+    parser.add_argument('--output', help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+        print(f"Benchmarking corpus of {size} files...", file=sys.stderr)
+        result = run_size(size, args)
+        results.append(result)
+        print(
+            f"  ingest {result['ingest_seconds']:.3f}s, reingest {result['reingest_seconds']:.3f}s, "
+            f"index {result['index_build_seconds']:.3f}s, "
+            f"query p50 {result['query_p50_ms']:.2f}ms p99 {result['query_p99_ms']:.2f}ms",
+            file=sys.stderr
+        )
+
+    report = {
+        'benchmark': 'gdrive-gemini-offline',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {k: v for k, v in vars(args).items() if k != 'output'},
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,13 @@
 Helper script to check available Gemini models.
 Run this to see what models are available with your API key.
 """
-import google.generativeai as genai
 from config import GEMINI_API_KEY
+from startup_profile import maybe_profile_startup
 
 def list_available_models():
     """List all available Gemini models."""
     try:
+        import google.generativeai as genai
         genai.configure(api_key=GEMINI_API_KEY)
         
         print("=" * 60)
@@ -46,5 +47,6 @@ def list_available_models():
         return []
 
 if __name__ == '__main__':
+    maybe_profile_startup('check_models')
     list_available_models()
 
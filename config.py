@@ -21,9 +21,75 @@ GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-flash-latest')  # Options: 'gem
 # Download from: https://console.cloud.google.com/apis/credentials
 CREDENTIALS_FILE = os.getenv('CREDENTIALS_FILE', 'credentials.json')
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
+DRIVE_DOWNLOAD_WORKERS = int(os.getenv('DRIVE_DOWNLOAD_WORKERS', '8'))  # Parallel file downloads during ingest
+DRIVE_HTTP_TIMEOUT = int(os.getenv('DRIVE_HTTP_TIMEOUT', '60'))  # Seconds per Drive HTTP request
+# Processes parsing .docx/.xlsx during ingest (0 = parse in the download threads, the default on one CPU)
+OFFICE_EXTRACT_WORKERS = int(os.getenv('OFFICE_EXTRACT_WORKERS', str(min(4, os.cpu_count() or 1) if (os.cpu_count() or 1) > 1 else 0)))
 
 # Application Configuration
 CHUNK_SIZE = 10000  # Characters per chunk for document processing
 CHUNK_OVERLAP = 500  # Overlap between chunks
 MAX_CONTEXT_LENGTH = 30000  # Maximum context to send to Gemini per query
+PASSAGE_EXTRACTION = os.getenv('PASSAGE_EXTRACTION', '1').lower() in ('1', 'true', 'yes')  # Send matching sentences, not whole chunks
+PASSAGE_WINDOW_SENTENCES = int(os.getenv('PASSAGE_WINDOW_SENTENCES', '1'))  # Sentences kept around each match
+PASSAGE_MAX_CHARS = int(os.getenv('PASSAGE_MAX_CHARS', '2000'))  # Passage budget per retrieved chunk
+TABLE_STORE = os.getenv('TABLE_STORE', '1').lower() in ('1', 'true', 'yes')  # Parse CSV files and Sheets into columnar tables
+TABLE_MAX_ROWS = int(os.getenv('TABLE_MAX_ROWS', '50'))  # Matching rows sent per table
+CORPUS_CONTEXT_LENGTH = int(os.getenv('CORPUS_CONTEXT_LENGTH', str(MAX_CONTEXT_LENGTH)))  # Whole-corpus fallback prefix size
 
+# Gemini explicit context caching for the whole-corpus fallback
+# The corpus prefix is uploaded once per corpus version; queries then send only the question.
+GEMINI_CONTEXT_CACHING = os.getenv('GEMINI_CONTEXT_CACHING', '1').lower() in ('1', 'true', 'yes')
+CONTEXT_CACHE_TTL_SECONDS = int(os.getenv('CONTEXT_CACHE_TTL_SECONDS', '3600'))
+
+# Gemini request limits (0 = unlimited); free tier flash models allow about 15 requests per minute
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv('GEMINI_REQUESTS_PER_MINUTE', '0'))
+GEMINI_MAX_CONCURRENT = int(os.getenv('GEMINI_MAX_CONCURRENT', '0'))
+
+# Hedged Gemini requests: a call slower than HEDGE_PERCENTILE of recent latency
+# gets a second request (same model, or the next model from the fallback list)
+GEMINI_HEDGING = os.getenv('GEMINI_HEDGING', '').lower() in ('1', 'true', 'yes')
+GEMINI_HEDGE_MODEL = os.getenv('GEMINI_HEDGE_MODEL', '')  # '' = same model, 'fallback' = next working model name, or a model name
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))  # Latency samples needed before hedging
+HEDGE_MIN_DELAY_MS = float(os.getenv('HEDGE_MIN_DELAY_MS', '250'))
+HEDGE_BUDGET = float(os.getenv('HEDGE_BUDGET', '0.1'))  # Hedges per request, at most
+FAILOVER_LATENCY_RATIO = float(os.getenv('FAILOVER_LATENCY_RATIO', '2.0'))  # Switch primary when it is this much slower
+HEDGE_LATENCY_WINDOW_SECONDS = float(os.getenv('HEDGE_LATENCY_WINDOW_SECONDS', '300'))  # Latency samples older than this are dropped
+
+# Admission control for /api/query (per process; ADMISSION_MAX_CONCURRENT=0 disables it)
+ADMISSION_MAX_CONCURRENT = int(os.getenv('ADMISSION_MAX_CONCURRENT', '8'))  # Queries answered at once
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '64'))  # Queries waiting for a slot
+INTERACTIVE_DEADLINE_SECONDS = float(os.getenv('INTERACTIVE_DEADLINE_SECONDS', '30'))  # Default deadline, interactive callers
+BATCH_DEADLINE_SECONDS = float(os.getenv('BATCH_DEADLINE_SECONDS', '300'))  # Default deadline, batch callers
+
+# Map-reduce query mode (one extraction prompt per chunk, then a combining prompt)
+MAP_REDUCE_WORKERS = int(os.getenv('MAP_REDUCE_WORKERS', '8'))  # Concurrent map prompts per query
+MAP_REDUCE_MAX_CHUNKS = int(os.getenv('MAP_REDUCE_MAX_CHUNKS', '64'))  # Chunks mapped per query; best-matching first when exceeded
+MAP_CACHE_SIZE = int(os.getenv('MAP_CACHE_SIZE', '4096'))  # Cached (chunk, query) map results
+
+# Offline fake backends (benchmarks and load tests)
+# When enabled, the app serves a synthetic corpus through fake Drive and Gemini
+# backends instead of calling Google APIs.
+USE_FAKE_BACKENDS = os.getenv('USE_FAKE_BACKENDS', '').lower() in ('1', 'true', 'yes')
+FAKE_CORPUS_SIZE = int(os.getenv('FAKE_CORPUS_SIZE', '200'))
+FAKE_DRIVE_LATENCY_MS = float(os.getenv('FAKE_DRIVE_LATENCY_MS', '0'))
+FAKE_GEMINI_LATENCY_MS = float(os.getenv('FAKE_GEMINI_LATENCY_MS', '500'))
+
+# On-demand profiling
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')  # Enables POST /admin/profile
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')  # Required in the X-Admin-Token header; /admin/profile refuses requests while unset
+PROFILE_INGEST_DIR = os.getenv('PROFILE_INGEST_DIR', '')  # Profile every ingest and write reports to this directory
+
+# Production server (serve.py)
+# Directory where worker processes share metrics so /metrics reports the whole
+# server (serve.py uses a temporary directory when running several workers)
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+SERVER_BIND = os.getenv('SERVER_BIND', '0.0.0.0:8000')
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '2'))  # Processes forked after the corpus is loaded
+# Request threads per worker; enough for every admission slot and queue entry, plus
+# headroom so /api/status and /metrics are not stuck behind queued queries
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', str(
+    ADMISSION_MAX_CONCURRENT + ADMISSION_MAX_QUEUE + 4 if ADMISSION_MAX_CONCURRENT > 0 else 8
+)))
+SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', '120'))  # Seconds before a stuck worker is restarted
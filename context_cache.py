@@ -0,0 +1,180 @@
+"""
+Prompt-prefix caching for the whole-corpus query path.
+The corpus prefix is built once per corpus version and, with Gemini, stored
+server-side as cached content so later queries send only the question.
+"""
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Optional
+from metrics import record_cache
+
+
+class ContextCache:
+    """Interface for generating answers from a large prefix that rarely changes."""
+
+    def generate(self, version: str, build_prefix: Callable[[], str], suffix: str):
+        """
+        Generate a response for prefix + suffix.
+
+        Args:
+            version: Identifier of the prefix contents (e.g. corpus version);
+                a new version replaces the cached prefix
+            build_prefix: Builds the prefix; only called when version changes
+            suffix: Per-request part of the prompt
+
+        Returns:
+            Model response object (with a .text attribute)
+        """
+        raise NotImplementedError
+
+    def invalidate(self):
+        """Drop the cached prefix."""
+        raise NotImplementedError
+
+
+class InlineContextCache(ContextCache):
+    """
+    Builds the prefix once per version and sends it inline with each request.
+
+    Works with any model exposing generate_content, including fakes, and is
+    the fallback when server-side caching is unavailable.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.version = None
+        self.prefix = None
+        self.builds = 0
+        self._lock = threading.Lock()
+
+    def _prefix_for(self, version: str, build_prefix: Callable[[], str]) -> str:
+        with self._lock:
+            hit = version == self.version
+            record_cache('corpus_prefix', hit)
+            if not hit:
+                self.prefix = build_prefix()
+                self.version = version
+                self.builds += 1
+            return self.prefix
+
+    def generate(self, version: str, build_prefix: Callable[[], str], suffix: str):
+        prefix = self._prefix_for(version, build_prefix)
+        return self.model.generate_content(prefix + suffix)
+
+    def invalidate(self):
+        with self._lock:
+            self.version = None
+            self.prefix = None
+
+
+class GeminiContextCache(ContextCache):
+    """
+    Registers the prefix with Gemini's cached-content API.
+
+    Caches are named after the version, so every worker process serving the
+    same corpus reuses one server-side cache. If the model or prefix cannot be
+    cached (e.g. below the minimum token count), requests fall back to
+    sending the prefix inline.
+    """
+
+    DISPLAY_PREFIX = 'gdrive-corpus-'
+
+    def __init__(self, model, ttl_seconds: int = 3600):
+        """
+        Args:
+            model: genai.GenerativeModel the cache is created for
+            ttl_seconds: Lifetime of each server-side cache
+        """
+        self.model = model
+        self.ttl_seconds = ttl_seconds
+        self.version = None
+        self._cached_content = None
+        self._cached_model = None
+        self._expires_at = 0.0
+        self._inline = InlineContextCache(model)
+        self._lock = threading.Lock()
+
+    def _find_existing(self, caching, display_name: str):
+        """Return a live cache created for this version by another process, if any."""
+        for cached in caching.CachedContent.list(page_size=100):
+            if cached.display_name == display_name and cached.model == self.model.model_name:
+                return cached
+        return None
+
+    def _ensure(self, version: str, build_prefix: Callable[[], str]) -> Optional[object]:
+        """Return a model bound to the cache for version, creating it if needed."""
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        with self._lock:
+            # Renew a little before the server-side TTL runs out
+            if version == self.version and time.monotonic() < self._expires_at:
+                record_cache('gemini_context', self._cached_model is not None)
+                return self._cached_model
+            if version == self.version and self._cached_content is not None:
+                # Same corpus: extend the existing cache instead of re-uploading it
+                try:
+                    self._cached_content.update(ttl=timedelta(seconds=self.ttl_seconds))
+                    self._expires_at = time.monotonic() + self.ttl_seconds * 0.9
+                    record_cache('gemini_context', True)
+                    return self._cached_model
+                except Exception as e:
+                    print(f"⚠️  Could not extend cached context, re-creating it: {str(e)[:200]}")
+            record_cache('gemini_context', False)
+
+            self.invalidate_locked()
+            self.version = version
+            self._expires_at = time.monotonic() + self.ttl_seconds * 0.9
+            display_name = f"{self.DISPLAY_PREFIX}{version[:32]}"
+            try:
+                cached = self._find_existing(caching, display_name)
+                if cached is None:
+                    cached = caching.CachedContent.create(
+                        model=self.model.model_name,
+                        display_name=display_name,
+                        contents=[build_prefix()],
+                        ttl=timedelta(seconds=self.ttl_seconds),
+                    )
+                self._cached_content = cached
+                self._cached_model = genai.GenerativeModel.from_cached_content(cached_content=cached)
+                print(f"✓ Cached corpus context as {cached.name}")
+            except Exception as e:
+                # Too small to cache, unsupported model, quota... send inline
+                print(f"⚠️  Context caching unavailable, sending corpus inline: {str(e)[:200]}")
+                self._cached_content = None
+                self._cached_model = None
+            return self._cached_model
+
+    def generate(self, version: str, build_prefix: Callable[[], str], suffix: str):
+        cached_model = self._ensure(version, build_prefix)
+        if cached_model is None:
+            return self._inline.generate(version, build_prefix, suffix)
+        try:
+            return cached_model.generate_content(suffix)
+        except Exception as e:
+            message = str(e).lower()
+            if '404' not in message and 'not found' not in message:
+                raise
+            # Expired early or deleted by a worker that loaded a newer corpus
+            with self._lock:
+                if self._cached_model is cached_model:
+                    self.invalidate_locked()
+            return self._inline.generate(version, build_prefix, suffix)
+
+    def invalidate_locked(self):
+        """Drop the server-side cache; caller holds the lock."""
+        if self._cached_content is not None:
+            try:
+                self._cached_content.delete()
+            except Exception:
+                pass  # Already expired or deleted by another worker
+        self._cached_content = None
+        self._cached_model = None
+        self.version = None
+        self._expires_at = 0.0
+        self._inline.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self.invalidate_locked()
@@ -1,40 +1,131 @@
 """
 Google Drive API connector to read documents from a specified folder.
-Supports Google Docs, PDFs, Word documents, and text files.
+Supports Google Docs, PDFs, Word and Excel documents, and text files.
 """
 import io
+import json
 import os
-from typing import List, Dict
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-import PyPDF2
-from config import SCOPES, CREDENTIALS_FILE
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Dict, Optional
+from config import (
+    SCOPES, CREDENTIALS_FILE, DRIVE_DOWNLOAD_WORKERS, DRIVE_HTTP_TIMEOUT,
+    OFFICE_EXTRACT_WORKERS
+)
+from metrics import timed, record_cache, BYTES_DOWNLOADED, FILES_PROCESSED
+from office_extract import OFFICE_MIME_TYPES, extract_office
+from profiling import active_session
+from rag_processor import content_hash
+
+TOKEN_FILE = 'token.json'
+
+METADATA_FIELDS = 'id, name, mimeType, modifiedTime, md5Checksum, size'
+
+
+@lru_cache(maxsize=1)
+def _drive_discovery_document() -> str:
+    """
+    Return the Drive v3 discovery document, read once per process.
+    
+    Uses the copy bundled with googleapiclient, so building a service never
+    fetches it over the network.
+    """
+    from googleapiclient.discovery_cache import get_static_doc
+    return get_static_doc('drive', 'v3')
+
+
+def build_drive_service(credentials=None, http=None):
+    """
+    Build a Drive v3 service from the locally cached discovery document.
+    
+    Args:
+        credentials: OAuth2 credentials
+        http: Optional httplib2.Http-like transport (instead of credentials)
+        
+    Returns:
+        googleapiclient Drive v3 Resource
+    """
+    from googleapiclient.discovery import build, build_from_document
+    
+    document = _drive_discovery_document()
+    if document is None:
+        return build('drive', 'v3', credentials=credentials, http=http, static_discovery=True)
+    return build_from_document(json.loads(document), credentials=credentials, http=http)
 
 
 class DriveConnector:
     """Handles connection to Google Drive and document retrieval."""
     
-    def __init__(self, folder_id: str):
+    def __init__(self, folder_id: str, service=None):
         """
         Initialize Drive connector.
         
         Args:
             folder_id: Google Drive folder ID to connect to
+            service: Optional pre-built Drive v3 service (e.g. a fake for
+                benchmarks); skips OAuth when given. It is shared by all
+                threads, so its transport must be thread-safe.
         """
         self.folder_id = folder_id
-        self.service = self._authenticate()
+        self._shared_service = service
+        self._credentials = None
+        self._credentials_lock = threading.Lock()
+        self._saved_token = None
+        self._local = threading.local()
+        # file id -> (version, content), so unchanged files are not re-downloaded
+        self._content_cache = {}
+        # Process pool for Office parsing; only exists while get_all_documents runs
+        self._office_pool = None
+        self._office_pool_lock = threading.Lock()
+        self._ingesting = False
+        # One get_all_documents at a time: they share the pool, the flag and the content cache
+        self._ingest_lock = threading.Lock()
+        
+        if service is None:
+            self._credentials = self._authenticate()
+    
+    @property
+    def service(self):
+        """
+        Drive service for the calling thread.
+        
+        httplib2 connections are not thread-safe, so each thread gets its own
+        authorized keep-alive connection on top of the shared credentials.
+        """
+        if self._shared_service is not None:
+            return self._shared_service
+        
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            import httplib2
+            import google_auth_httplib2
+            
+            http = google_auth_httplib2.AuthorizedHttp(
+                self._credentials, http=httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT)
+            )
+            service = build_drive_service(http=http)
+            self._local.service = service
+        return service
+    
+    def reset_clients(self):
+        """Drop per-thread clients, e.g. after forking, so new connections are opened."""
+        self._local = threading.local()
     
     def _authenticate(self):
-        """Authenticate and return Google Drive service."""
+        """Authenticate and return credentials shared by all threads."""
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
+        
         creds = None
-        token_file = 'token.json'
         
         # Load existing token
-        if os.path.exists(token_file):
-            creds = Credentials.from_authorized_user_file(token_file, SCOPES)
+        if os.path.exists(TOKEN_FILE):
+            creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+            self._saved_token = creds.to_json()
         
         # If no valid credentials, get new ones
         if not creds or not creds.valid:
@@ -51,10 +142,43 @@ class DriveConnector:
                 creds = flow.run_local_server(port=0)
             
             # Save credentials for next run
-            with open(token_file, 'w') as token:
-                token.write(creds.to_json())
+            self._save_token(creds)
+        
+        self._serialize_refresh(creds)
+        return creds
+    
+    def _serialize_refresh(self, creds):
+        """Make concurrent refreshes of the shared credentials happen once, under a lock."""
+        refresh = creds.refresh
+        
+        def locked_refresh(request):
+            stale_token = creds.token
+            with self._credentials_lock:
+                # Another thread refreshed while we waited
+                if creds.token != stale_token and creds.valid:
+                    return
+                refresh(request)
+                self._save_token(creds)
         
-        return build('drive', 'v3', credentials=creds)
+        creds.refresh = locked_refresh
+    
+    def _save_token(self, creds):
+        """Write token.json atomically, and only when its contents changed."""
+        token_json = creds.to_json()
+        if token_json == self._saved_token:
+            return
+        
+        # Unique per write, and in the same directory so os.replace stays atomic
+        token_dir = os.path.dirname(os.path.abspath(TOKEN_FILE))
+        fd, tmp_file = tempfile.mkstemp(dir=token_dir, prefix='.token-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as token:
+                token.write(token_json)
+            os.replace(tmp_file, TOKEN_FILE)
+        except Exception:
+            os.unlink(tmp_file)
+            raise
+        self._saved_token = token_json
     
     def list_files(self) -> List[Dict]:
         """
@@ -64,13 +188,24 @@ class DriveConnector:
             List of file metadata dictionaries
         """
         query = f"'{self.folder_id}' in parents and trashed=false"
-        results = self.service.files().list(
-            q=query,
-            fields="files(id, name, mimeType, size)",
-            pageSize=100
-        ).execute()
+        files = []
+        page_token = None
+        
+        with timed('drive_list_files'):
+            while True:
+                results = self.service.files().list(
+                    q=query,
+                    fields=f"nextPageToken, files({METADATA_FIELDS})",
+                    pageSize=1000,
+                    pageToken=page_token
+                ).execute()
+                files.extend(results.get('files', []))
+                
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
         
-        return results.get('files', [])
+        return files
     
     def get_file_content(self, file_id: str, mime_type: str) -> str:
         """
@@ -102,13 +237,14 @@ class DriveConnector:
             elif mime_type in ['text/plain', 'text/csv']:
                 content = self._get_text_content(file_id)
             
-            # Microsoft Office files (export as text)
-            elif mime_type in [
-                'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                'application/msword'
-            ]:
+            # Microsoft Office files (.docx, .xlsx), parsed locally
+            elif mime_type in OFFICE_MIME_TYPES:
                 content = self._get_office_content(file_id, mime_type)
             
+            # Legacy binary Word files cannot be exported or parsed locally
+            elif mime_type == 'application/msword':
+                print(f"Unsupported legacy .doc file {file_id}: convert it to .docx or Google Docs")
+            
             else:
                 print(f"Unsupported file type: {mime_type}")
         
@@ -117,6 +253,21 @@ class DriveConnector:
         
         return content
     
+    def _download(self, request) -> bytes:
+        """Execute a media request and return the downloaded bytes."""
+        from googleapiclient.http import MediaIoBaseDownload
+        
+        with timed('drive_download'):
+            fh = io.BytesIO()
+            downloader = MediaIoBaseDownload(fh, request)
+            done = False
+            while done is False:
+                status, done = downloader.next_chunk()
+        
+        data = fh.getvalue()
+        BYTES_DOWNLOADED.inc(len(data))
+        return data
+    
     def _get_google_workspace_content(self, file_id: str, mime_type: str) -> str:
         """Extract content from Google Workspace files."""
         if mime_type == 'application/vnd.google-apps.document':
@@ -140,83 +291,164 @@ class DriveConnector:
         else:
             return ""
         
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        
-        return fh.getvalue().decode('utf-8', errors='ignore')
+        data = self._download(request)
+        with timed('extract'):
+            return data.decode('utf-8', errors='ignore')
     
     def _get_pdf_content(self, file_id: str) -> str:
         """Extract text from PDF files."""
+        import PyPDF2
+        
         request = self.service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        
-        fh.seek(0)
-        pdf_reader = PyPDF2.PdfReader(fh)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
+        data = self._download(request)
+        
+        with timed('extract'):
+            pdf_reader = PyPDF2.PdfReader(io.BytesIO(data))
+            text = ""
+            for page in pdf_reader.pages:
+                text += page.extract_text() + "\n"
         
         return text
     
     def _get_text_content(self, file_id: str) -> str:
         """Extract content from plain text files."""
         request = self.service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        
-        return fh.getvalue().decode('utf-8', errors='ignore')
+        data = self._download(request)
+        with timed('extract'):
+            return data.decode('utf-8', errors='ignore')
     
     def _get_office_content(self, file_id: str, mime_type: str) -> str:
-        """Extract content from Microsoft Office files by exporting as text."""
-        # Export Word docs as plain text
-        export_mime = 'text/plain'
-        request = self.service.files().export_media(
-            fileId=file_id,
-            mimeType=export_mime
-        )
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
-        
-        return fh.getvalue().decode('utf-8', errors='ignore')
-    
-    def get_all_documents(self) -> Dict[str, str]:
+        """Download an uploaded Office file and parse it locally."""
+        # Drive only exports native Google formats; uploaded Office files are downloaded as-is
+        request = self.service.files().get_media(fileId=file_id)
+        data = self._download(request)
+        
+        with timed('extract'):
+            pool = self._office_executor()
+            if pool is None:
+                return extract_office(mime_type, data)
+            # Parsing is CPU-bound; a process pool keeps it off the GIL
+            from concurrent.futures.process import BrokenProcessPool
+            try:
+                return pool.submit(extract_office, mime_type, data).result()
+            except BrokenProcessPool:
+                # Workers could not start (e.g. unimportable __main__); parse here instead
+                return extract_office(mime_type, data)
+    
+    def _office_executor(self):
+        """Return the ingest's Office parsing pool, starting it on first use."""
+        if not self._ingesting or OFFICE_EXTRACT_WORKERS <= 0:
+            return None
+        with self._office_pool_lock:
+            if self._office_pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # Spawned workers only import office_extract; forking would
+                # copy the download threads' locks mid-ingest
+                self._office_pool = ProcessPoolExecutor(
+                    max_workers=OFFICE_EXTRACT_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._office_pool
+    
+    def get_all_documents(self) -> Dict[str, Dict]:
         """
         Retrieve all documents from the folder and extract their content.
         
+        Files with identical content share a single stored string.
+        Concurrent calls (e.g. a reload during a profiled ingest) run one
+        after the other; the later one reuses the content cache.
+        
         Returns:
-            Dictionary mapping file names to their content
+            Dictionary mapping file IDs to document records with 'name',
+            'mime_type', 'content' and 'content_hash'
         """
+        with self._ingest_lock:
+            return self._get_all_documents()
+    
+    def _get_all_documents(self) -> Dict[str, Dict]:
+        """List and extract the folder (see get_all_documents); caller holds the ingest lock."""
         files = self.list_files()
         documents = {}
+        canonical = {}
+        # Rebuilt from this listing, so deleted or emptied files leave the cache
+        content_cache = {}
         
         print(f"Found {len(files)} files in folder. Processing...")
         
-        for file in files:
-            file_name = file['name']
-            file_id = file['id']
-            mime_type = file.get('mimeType', '')
-            
-            print(f"Processing: {file_name}")
-            content = self.get_file_content(file_id, mime_type)
+        # Each worker thread downloads over its own pooled connection
+        self._ingesting = True
+        try:
+            with ThreadPoolExecutor(max_workers=DRIVE_DOWNLOAD_WORKERS) as executor:
+                contents = list(executor.map(self._process_file, files))
+        finally:
+            self._ingesting = False
+            if self._office_pool is not None:
+                self._office_pool.shutdown()
+                self._office_pool = None
+        
+        for file, content in zip(files, contents):
+            if not content:
+                continue
             
-            if content:
-                documents[file_name] = content
-                print(f"  ✓ Extracted {len(content)} characters from {file_name}")
-            else:
-                print(f"  ✗ Could not extract content from {file_name}")
+            digest = content_hash(content)
+            content = canonical.setdefault(digest, content)
+            cached = self._content_cache.get(file['id'])
+            if cached is not None:
+                content_cache[file['id']] = (cached[0], content)
+            documents[file['id']] = {
+                'name': file['name'],
+                'mime_type': file.get('mimeType', ''),
+                'content': content,
+                'content_hash': digest,
+            }
+        
+        self._content_cache = content_cache
+        
+        duplicates = len(documents) - len(canonical)
+        if duplicates:
+            print(f"Found {duplicates} duplicate documents (stored once)")
         
         return documents
+    
+    def _process_file(self, file: Dict) -> str:
+        """Extract one listed file, reusing cached content if it is unchanged."""
+        file_name = file['name']
+        file_id = file['id']
+        mime_type = file.get('mimeType', '')
+        version = self._file_version(file)
+        
+        cached = self._content_cache.get(file_id)
+        if version is not None and cached is not None and cached[0] == version:
+            record_cache('drive_content', True)
+            FILES_PROCESSED.inc(outcome='cached')
+            print(f"Unchanged: {file_name}")
+            return cached[1]
+        record_cache('drive_content', False)
+        
+        print(f"Processing: {file_name}")
+        session = active_session()
+        cpu_start = time.thread_time() if session is not None else 0.0
+        with timed('drive_process_file') as span:
+            content = self.get_file_content(file_id, mime_type)
+        if session is not None:
+            # CPU time of this thread only; Office parsing in the process pool shows as wall time
+            session.record_document(
+                file_id, file_name, mime_type, span.elapsed, time.thread_time() - cpu_start, len(content)
+            )
+        
+        if content:
+            self._content_cache[file_id] = (version, content)
+            FILES_PROCESSED.inc(outcome='extracted')
+            print(f"  ✓ Extracted {len(content)} characters from {file_name}")
+        else:
+            FILES_PROCESSED.inc(outcome='empty')
+            print(f"  ✗ Could not extract content from {file_name}")
+        
+        return content
+    
+    @staticmethod
+    def _file_version(file: Dict) -> Optional[str]:
+        """Return a value that changes whenever the file content changes."""
+        return file.get('md5Checksum') or file.get('modifiedTime')
 
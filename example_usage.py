@@ -77,10 +77,10 @@ def example_specific_file():
     documents = drive.get_all_documents()
     
     # Get specific file
-    file_name = list(documents.keys())[0] if documents else None
-    if file_name:
-        print(f"\nQuerying file: {file_name}")
-        file_content = documents[file_name]
+    file_id = next(iter(documents), None)
+    if file_id:
+        print(f"\nQuerying file: {documents[file_id]['name']}")
+        file_content = documents[file_id]['content']
         
         gemini = GeminiConnector()
         query = "What is this document about?"
@@ -0,0 +1,415 @@
+"""
+Offline fakes for Google Drive and Gemini, plus a synthetic corpus generator.
+Used by the benchmark and load-test tools to exercise the real connectors
+without Google credentials or network access.
+"""
+import csv
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+import zipfile
+from itertools import accumulate
+from typing import Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+import httplib2
+
+from drive_connector import build_drive_service
+
+FAKE_FOLDER_ID = 'fake-folder'
+
+DEFAULT_MIME_MIX = {
+    'application/vnd.google-apps.document': 0.4,
+    'text/plain': 0.3,
+    'application/pdf': 0.2,
+    'text/csv': 0.1,
+}
+
+_EXTENSIONS = {
+    'application/vnd.google-apps.document': '',
+    'application/vnd.google-apps.spreadsheet': '',
+    'application/vnd.google-apps.presentation': '',
+    'application/pdf': '.pdf',
+    'text/plain': '.txt',
+    'text/csv': '.csv',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': '.xlsx',
+}
+
+_TABULAR = (
+    'text/csv',
+    'application/vnd.google-apps.spreadsheet',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+)
+
+_SYLLABLES = [
+    'ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'zo', 'pe', 'si', 'gu',
+    'an', 'el', 'or', 'ix', 'um', 'ba', 'de', 'fo', 'hi', 'ju',
+]
+
+
+def _make_vocabulary(size: int, seed: int) -> List[str]:
+    """Generate deterministic pseudo-words."""
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def make_pdf(lines: List[str], lines_per_page: int = 60) -> bytes:
+    """
+    Build a minimal multi-page PDF whose text PyPDF2 can extract.
+
+    Args:
+        lines: Text lines to place on the pages
+        lines_per_page: Lines per page before starting a new page
+
+    Returns:
+        PDF file bytes
+    """
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    font_obj = 3 + 2 * len(pages)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            ' '.join(f"{3 + 2 * i} 0 R" for i in range(len(pages))), len(pages)
+        ),
+    ]
+    for i, page_lines in enumerate(pages):
+        stream = "BT /F1 10 Tf 12 TL 40 770 Td " + ' '.join(
+            f"({_pdf_escape(line)}) Tj T*" for line in page_lines
+        ) + " ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Contents {4 + 2 * i} 0 R /Resources << /Font << /F1 {font_obj} 0 R >> >> >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1', errors='replace')
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def make_docx(lines: List[str]) -> bytes:
+    """
+    Build a minimal .docx with one paragraph per line.
+
+    Args:
+        lines: Paragraph texts
+
+    Returns:
+        .docx file bytes
+    """
+    from xml.sax.saxutils import escape
+
+    body = ''.join(f'<w:p><w:r><w:t xml:space="preserve">{escape(line)}</w:t></w:r></w:p>' for line in lines)
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        archive.writestr('_rels/.rels', (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Target="word/document.xml" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+            '</Relationships>'
+        ))
+        archive.writestr('word/document.xml', (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{body}</w:body></w:document>'
+        ))
+    return out.getvalue()
+
+
+def make_xlsx(csv_text: str) -> bytes:
+    """
+    Build a single-sheet .xlsx from CSV text.
+
+    Args:
+        csv_text: Rows to write, header first
+
+    Returns:
+        .xlsx file bytes
+    """
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    for row in csv.reader(io.StringIO(csv_text)):
+        sheet.append(row)
+    out = io.BytesIO()
+    workbook.save(out)
+    return out.getvalue()
+
+
+class SyntheticCorpus:
+    """
+    Deterministic synthetic Drive folder.
+
+    File contents are generated on demand from a per-file seed, so the fake
+    itself holds no document text and does not distort memory measurements.
+    """
+
+    def __init__(self, num_files: int, mime_mix: Optional[Dict[str, float]] = None,
+                 min_size: int = 2000, max_size: int = 20000,
+                 vocabulary_size: int = 5000, duplicate_ratio: float = 0.0, seed: int = 42):
+        """
+        Args:
+            num_files: Number of files in the fake folder
+            mime_mix: MIME type -> relative weight
+            min_size: Minimum approximate document size in characters
+            max_size: Maximum approximate document size in characters
+            vocabulary_size: Number of distinct words to draw from
+            duplicate_ratio: Fraction of files that copy an earlier file's
+                content (and type) under a "Copy of" name
+            seed: Seed for all generated content
+        """
+        self.num_files = num_files
+        self.mime_mix = mime_mix or DEFAULT_MIME_MIX
+        self.min_size = min_size
+        self.max_size = max_size
+        self.seed = seed
+        self.vocabulary = _make_vocabulary(vocabulary_size, seed)
+        # Zipf-like word frequencies, like natural text
+        self._cum_weights = list(accumulate(1.0 / (rank + 1) for rank in range(vocabulary_size)))
+
+        rng = random.Random(seed)
+        mime_types = list(self.mime_mix)
+        weights = [self.mime_mix[m] for m in mime_types]
+        self.files = []
+        # file index -> index of the file whose content it copies
+        self._source = {}
+        for index in range(num_files):
+            if index and rng.random() < duplicate_ratio:
+                source = self._source.get(rng.randrange(index))
+                source = rng.randrange(index) if source is None else source
+                self._source[index] = source
+                original = self.files[source]
+                self.files.append({
+                    'id': f"fake-{index:07d}",
+                    'name': f"Copy of {original['name']}",
+                    'mimeType': original['mimeType'],
+                    'modifiedTime': '2024-01-01T00:00:00.000Z',
+                })
+                continue
+            mime_type = rng.choices(mime_types, weights=weights)[0]
+            self.files.append({
+                'id': f"fake-{index:07d}",
+                'name': f"doc-{index:06d}{_EXTENSIONS.get(mime_type, '')}",
+                'mimeType': mime_type,
+                'modifiedTime': '2024-01-01T00:00:00.000Z',
+            })
+        for index, meta in enumerate(self.files):
+            if not meta['mimeType'].startswith('application/vnd.google-apps.'):
+                # Derived from the content seed rather than the generated bytes, so
+                # listing stays cheap; copies share it, as real duplicates would
+                source = self._source.get(index, index)
+                meta['md5Checksum'] = hashlib.md5(f"{seed}:{source}".encode()).hexdigest()
+        self._by_id = {f['id']: (i, f) for i, f in enumerate(self.files)}
+
+    def get(self, file_id: str) -> Optional[Dict]:
+        """Return file metadata by id."""
+        entry = self._by_id.get(file_id)
+        return entry[1] if entry else None
+
+    def text(self, file_id: str) -> str:
+        """Generate the plain text of a file."""
+        index, meta = self._by_id[file_id]
+        index = self._source.get(index, index)
+        rng = random.Random(self.seed * 1000003 + index)
+        target = rng.randint(self.min_size, self.max_size)
+
+        if meta['mimeType'] in _TABULAR:
+            columns = 5
+            header = ','.join(f"col_{c}" for c in range(columns))
+            rows = [header]
+            size = len(header)
+            row_number = 0
+            while size < target:
+                words = rng.choices(self.vocabulary, cum_weights=self._cum_weights, k=columns - 1)
+                row = f"{row_number},{','.join(words)}"
+                rows.append(row)
+                size += len(row) + 1
+                row_number += 1
+            return '\n'.join(rows)
+
+        # Average pseudo-word plus space is about 7 characters
+        words = rng.choices(self.vocabulary, cum_weights=self._cum_weights, k=max(target // 7, 1))
+        lines = [' '.join(words[i:i + 12]) + '.' for i in range(0, len(words), 12)]
+        return '\n'.join(lines)
+
+    def content(self, file_id: str) -> bytes:
+        """Generate the raw bytes Drive would serve for a file."""
+        text = self.text(file_id)
+        mime_type = self.get(file_id)['mimeType']
+        if mime_type == 'application/pdf':
+            return make_pdf(text.split('\n'))
+        if mime_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document':
+            return make_docx(text.split('\n'))
+        if mime_type == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet':
+            return make_xlsx(text)
+        return text.encode('utf-8')
+
+    def sample_queries(self, count: int, words_per_query: int = 4, seed: int = 7) -> List[str]:
+        """Sample queries from the corpus vocabulary."""
+        rng = random.Random(seed)
+        return [
+            ' '.join(rng.choices(self.vocabulary, cum_weights=self._cum_weights, k=words_per_query))
+            for _ in range(count)
+        ]
+
+
+class FakeDriveHttp:
+    """
+    httplib2.Http stand-in that serves a SyntheticCorpus over the Drive v3 REST
+    surface used by DriveConnector (files.list, get_media and export_media).
+
+    Listings include md5Checksum for binary files, as Drive's do, so reloads
+    take the same unchanged-file path as against the real API.
+    """
+
+    def __init__(self, corpus: SyntheticCorpus, latency_ms: float = 0.0):
+        """
+        Args:
+            corpus: Corpus to serve
+            latency_ms: Simulated round-trip latency per HTTP request
+        """
+        self.corpus = corpus
+        self.latency = latency_ms / 1000.0
+        self.request_count = 0
+        self._lock = threading.Lock()
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=None, connection_type=None):
+        with self._lock:
+            self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        return self._route(uri, headers or {})
+
+    def _route(self, uri: str, headers: Dict[str, str]):
+        parsed = urlparse(uri)
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        parts = [p for p in parsed.path.split('/') if p]
+        # ['drive', 'v3', 'files', <id>, ('export')]
+        if parts[:3] != ['drive', 'v3', 'files']:
+            return self._error(404, f"Unknown path {parsed.path}")
+
+        if len(parts) == 3:
+            return self._list(params)
+
+        file_id = parts[3]
+        meta = self.corpus.get(file_id)
+        if meta is None:
+            return self._error(404, f"File not found: {file_id}")
+
+        if params.get('alt') != 'media':
+            return self._error(400, "Only alt=media requests are supported")
+
+        is_export = len(parts) == 5 and parts[4] == 'export'
+        is_workspace = meta['mimeType'].startswith('application/vnd.google-apps.')
+        if is_export != is_workspace:
+            return self._error(403, "fileNotDownloadable" if is_workspace else "Export only supports Docs Editors files.")
+
+        return self._media(self.corpus.content(file_id), headers)
+
+    def _list(self, params: Dict[str, str]):
+        page_size = int(params.get('pageSize', 100))
+        start = int(params.get('pageToken', 0))
+        end = start + page_size
+        payload = {'files': [dict(f) for f in self.corpus.files[start:end]]}
+        if end < len(self.corpus.files):
+            payload['nextPageToken'] = str(end)
+        return self._json(payload)
+
+    def _media(self, data: bytes, headers: Dict[str, str]):
+        range_header = {k.lower(): v for k, v in headers.items()}.get('range')
+        if range_header and range_header.startswith('bytes='):
+            first, last = range_header[len('bytes='):].split('-')
+            first, last = int(first), min(int(last), len(data) - 1)
+            if first >= len(data):
+                return httplib2.Response({'status': 416, 'content-range': f"bytes */{len(data)}"}), b''
+            chunk = data[first:last + 1]
+            return httplib2.Response({
+                'status': 206,
+                'content-range': f"bytes {first}-{last}/{len(data)}",
+                'content-length': str(len(chunk)),
+            }), chunk
+        return httplib2.Response({'status': 200, 'content-length': str(len(data))}), data
+
+    def _json(self, payload):
+        body = json.dumps(payload).encode('utf-8')
+        return httplib2.Response({'status': 200, 'content-type': 'application/json'}), body
+
+    def _error(self, status: int, message: str):
+        body = json.dumps({'error': {'code': status, 'message': message}}).encode('utf-8')
+        return httplib2.Response({'status': status, 'content-type': 'application/json'}), body
+
+
+def build_fake_drive_service(http: FakeDriveHttp):
+    """Build a real googleapiclient Drive v3 service on top of a FakeDriveHttp."""
+    return build_drive_service(http=http)
+
+
+class FakeResponse:
+    """Mimics the .text attribute of a Gemini response."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Stand-in for genai.GenerativeModel with simulated latency."""
+
+    def __init__(self, model_name: str = 'fake-gemini', latency_ms: float = 0.0,
+                 per_1k_chars_ms: float = 0.0):
+        """
+        Args:
+            model_name: Name reported by the model
+            latency_ms: Fixed latency per generate_content call
+            per_1k_chars_ms: Extra latency per 1,000 prompt characters
+        """
+        self.model_name = model_name
+        self.latency_ms = latency_ms
+        self.per_1k_chars_ms = per_1k_chars_ms
+        self.call_count = 0
+        self.prompt_chars = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, **kwargs):
+        prompt_text = prompt if isinstance(prompt, str) else str(prompt)
+        with self._lock:
+            self.call_count += 1
+            self.prompt_chars += len(prompt_text)
+        delay = self.latency_ms + self.per_1k_chars_ms * len(prompt_text) / 1000.0
+        if delay:
+            time.sleep(delay / 1000.0)
+        return FakeResponse(
+            f"[{self.model_name}] Answer generated from a {len(prompt_text)}-character prompt."
+        )
@@ -1,24 +1,76 @@
 """
 Google Gemini API connector for querying with document context.
 """
-import google.generativeai as genai
-from config import GEMINI_API_KEY, GEMINI_MODEL, MAX_CONTEXT_LENGTH
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List
+from config import (
+    GEMINI_API_KEY, GEMINI_MODEL, MAX_CONTEXT_LENGTH,
+    GEMINI_CONTEXT_CACHING, CONTEXT_CACHE_TTL_SECONDS,
+    GEMINI_REQUESTS_PER_MINUTE, GEMINI_MAX_CONCURRENT,
+    MAP_REDUCE_WORKERS, MAP_CACHE_SIZE,
+    GEMINI_HEDGING, GEMINI_HEDGE_MODEL, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES,
+    HEDGE_MIN_DELAY_MS, HEDGE_BUDGET, FAILOVER_LATENCY_RATIO, HEDGE_LATENCY_WINDOW_SECONDS
+)
+from context_cache import GeminiContextCache, InlineContextCache
+from hedging import HedgePolicy, LatencyHistory
+from metrics import timed, record_cache, HEDGED_REQUESTS
+from rate_limiter import RateLimiter
+
+# Map step output meaning "this excerpt has nothing relevant"
+NO_RELEVANT_CONTENT = 'NONE'
+# Reduce rounds before the remaining extracts are forced into one prompt
+MAX_REDUCE_ROUNDS = 4
+# Share of a map-reduce query's time budget kept for the reduce prompts
+REDUCE_TIME_SHARE = 0.25
 
 
 class GeminiConnector:
     """Handles interaction with Google Gemini API."""
     
-    def __init__(self):
-        """Initialize Gemini connector."""
+    def __init__(self, model=None, fallback_model=None):
+        """
+        Initialize Gemini connector.
+        
+        Args:
+            model: Optional pre-built model exposing generate_content (e.g. a
+                fake for benchmarks); skips API key checks and model discovery
+            fallback_model: Optional pre-built model used as the hedge target
+        """
+        # Shared by every generate_content call made through this connector
+        self.rate_limiter = RateLimiter(GEMINI_REQUESTS_PER_MINUTE, GEMINI_MAX_CONCURRENT)
+        # (model, chunk hash, normalized query) -> map step output
+        self._map_cache = OrderedDict()
+        self._map_cache_lock = threading.Lock()
+        # Recent latency per model name, for hedging and failover
+        self.latency = defaultdict(lambda: LatencyHistory(max_age=HEDGE_LATENCY_WINDOW_SECONDS))
+        self.fallback_model = fallback_model
+        self.hedge_policy = None
+        if GEMINI_HEDGING:
+            self.hedge_policy = HedgePolicy(
+                HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_MIN_DELAY_MS / 1000,
+                HEDGE_BUDGET, FAILOVER_LATENCY_RATIO
+            )
+            # Runs the primary and hedge calls so the caller can wait on both
+            self._hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix='gemini-hedge')
+        
+        if model is not None:
+            self.model = model
+            self.context_cache = InlineContextCache(model)
+            return
+        
         if not GEMINI_API_KEY or GEMINI_API_KEY == 'YOUR_GEMINI_API_KEY_HERE':
             raise ValueError(
                 "GEMINI_API_KEY not set. Please set it in .env file or config.py"
             )
         
+        import google.generativeai as genai
         genai.configure(api_key=GEMINI_API_KEY)
         
-        # Try different model name variations
-        model_names_to_try = [
+        # Try different model name variations (later entries double as hedge targets)
+        self.model_names_to_try = model_names_to_try = [
             GEMINI_MODEL,  # Try configured model first
             'gemini-flash-latest',  # Latest flash model
             'gemini-pro-latest',    # Latest pro model
@@ -66,6 +118,53 @@ class GeminiConnector:
                 f"Last error: {last_error}. "
                 f"Run 'py check_models.py' to see available models."
             )
+        
+        if GEMINI_HEDGING and GEMINI_HEDGE_MODEL:
+            self.fallback_model = self._build_fallback_model(genai)
+        
+        # Whole-corpus prefix, uploaded once per corpus version
+        if GEMINI_CONTEXT_CACHING:
+            self.context_cache = GeminiContextCache(self.model, ttl_seconds=CONTEXT_CACHE_TTL_SECONDS)
+        else:
+            self.context_cache = InlineContextCache(self.model)
+    
+    def _build_fallback_model(self, genai):
+        """
+        Build the hedge target named by GEMINI_HEDGE_MODEL.
+        
+        GenerativeModel accepts any name, so candidates are checked against
+        list_models. With 'fallback', models of the same tier as the primary
+        (flash or pro) are preferred, so a fast model is not hedged to a slow one.
+        """
+        try:
+            available = {
+                m.name.replace('models/', '') for m in genai.list_models()
+                if 'generateContent' in m.supported_generation_methods
+            }
+        except Exception as e:
+            print(f"⚠️  Could not list models to check the hedge model ({e}); hedging to the same model")
+            return None
+        
+        primary = self.model_name.replace('models/', '')
+        if GEMINI_HEDGE_MODEL != 'fallback':
+            candidates = [GEMINI_HEDGE_MODEL]
+        else:
+            tier = 'flash' if 'flash' in primary else 'pro' if 'pro' in primary else None
+            candidates = sorted(
+                (name for name in self.model_names_to_try if name != primary),
+                key=lambda name: tier is None or tier not in name
+            )
+        for name in candidates:
+            if name in available:
+                print(f"✓ Hedging slow calls to model: {name}")
+                return genai.GenerativeModel(name)
+        print(f"⚠️  Hedge model {', '.join(candidates) or '(none)'} not available; hedging to the same model")
+        return None
+    
+    @property
+    def model_name(self) -> str:
+        """Name of the model queries are sent to."""
+        return getattr(self.model, 'model_name', '')
     
     def query_with_context(self, user_query: str, context: str) -> str:
         """
@@ -78,36 +177,259 @@ class GeminiConnector:
         Returns:
             Gemini's response
         """
+        with timed('build_prompt'):
+            prompt = self._build_prompt(user_query, context)
+        
+        try:
+            return self._generate(prompt)
+        except Exception as e:
+            return self._format_error(e)
+    
+    def query_with_corpus(self, user_query: str, corpus_version: str,
+                          build_corpus: Callable[[], str]) -> str:
+        """
+        Query Gemini against the whole corpus.
+        
+        The corpus prefix is built and cached once per corpus_version (with
+        Gemini's cached-content API when enabled), so each query only sends
+        the question.
+        
+        Args:
+            user_query: User's question or prompt
+            corpus_version: Identifier of the loaded corpus
+            build_corpus: Returns the combined corpus text; called on version change
+            
+        Returns:
+            Gemini's response
+        """
+        try:
+            with self.rate_limiter, timed('generate_content'):
+                response = self.context_cache.generate(
+                    corpus_version,
+                    lambda: self._context_prefix(build_corpus()),
+                    self._question_suffix(user_query)
+                )
+            return response.text
+        except Exception as e:
+            return self._format_error(e)
+    
+    def query_map_reduce(self, user_query: str, chunks: List[Dict],
+                         label: Callable[[Dict], str] = None,
+                         deadline: float = None) -> str:
+        """
+        Answer a question over many chunks, for corpora larger than one prompt.
+        
+        Each chunk gets its own extraction (map) prompt; the calls run
+        concurrently under the rate limiter and are cached per chunk and query.
+        A map call that fails or is still running when the map phase runs out
+        of time counts as having nothing relevant. The relevant extracts are
+        then combined by reduce prompts, in several rounds if they do not fit
+        in MAX_CONTEXT_LENGTH.
+        
+        Args:
+            user_query: User's question or prompt
+            chunks: Chunks from RAGProcessor (needs 'content' and 'content_hash')
+            label: Returns the citation label for a chunk (default: its file name)
+            deadline: time.monotonic() by which an answer is needed; the map
+                phase stops early enough to leave time for the reduce prompts,
+                which return the extracted notes if they run out of time
+            
+        Returns:
+            Gemini's response
+        """
+        label = label or (lambda chunk: chunk['file'])
+        map_deadline = None
+        if deadline is not None:
+            now = time.monotonic()
+            map_deadline = now + (deadline - now) * (1 - REDUCE_TIME_SHARE)
+        
+        executor = ThreadPoolExecutor(max_workers=MAP_REDUCE_WORKERS)
+        try:
+            with timed('map_reduce'):
+                with timed('map'):
+                    futures = [executor.submit(self._map_chunk, user_query, chunk) for chunk in chunks]
+                    timeout = None if map_deadline is None else max(map_deadline - time.monotonic(), 0)
+                    done, not_done = wait(futures, timeout=timeout)
+                    for future in not_done:
+                        future.cancel()
+                
+                sections = []
+                errors = []
+                for chunk, future in zip(chunks, futures):
+                    if future not in done:
+                        continue
+                    if future.exception() is not None:
+                        errors.append(future.exception())
+                        continue
+                    extract = future.result()
+                    if extract.strip().upper() != NO_RELEVANT_CONTENT:
+                        sections.append(f"--- From file: {label(chunk)} ---\n{extract}\n")
+                print(f"Map step: {len(sections)} of {len(chunks)} chunks relevant"
+                      f" ({len(errors)} failed, {len(not_done)} timed out)")
+                if errors and len(errors) == len(done):
+                    # Nothing succeeded; report the API error rather than "no information"
+                    raise errors[0]
+                if not sections:
+                    if not_done:
+                        raise TimeoutError(
+                            f"map step timed out with {len(not_done)} of {len(chunks)} chunks unread"
+                        )
+                    return "The documents do not contain information relevant to this question."
+                
+                with timed('reduce'):
+                    return self._reduce(user_query, sections, deadline)
+        except Exception as e:
+            return self._format_error(e)
+        finally:
+            # Map calls already running finish in the background (and fill the
+            # map cache); calls not yet started are dropped
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _map_chunk(self, user_query: str, chunk: Dict) -> str:
+        """Extract what one chunk says about the query, reusing cached results."""
+        key = (self.model_name, chunk['content_hash'], ' '.join(user_query.lower().split()))
+        with self._map_cache_lock:
+            cached = self._map_cache.get(key)
+            if cached is not None:
+                self._map_cache.move_to_end(key)
+        record_cache('map_result', cached is not None)
+        if cached is not None:
+            return cached
+        
+        extract = self._generate(f"""Below is an excerpt from a document in Google Drive.
+
+{chunk['content']}
+
+---
+
+Question: {user_query}
+
+Extract every fact, item or passage from the excerpt that helps answer the question, keeping names, numbers and dates exact. Do not answer from outside knowledge. If nothing in the excerpt is relevant, reply with exactly {NO_RELEVANT_CONTENT}.""")
+        
+        with self._map_cache_lock:
+            self._map_cache[key] = extract
+            while len(self._map_cache) > MAP_CACHE_SIZE:
+                self._map_cache.popitem(last=False)
+        return extract
+    
+    def _reduce(self, user_query: str, sections: List[str], deadline: float = None) -> str:
+        """
+        Combine map extracts, reducing groups in parallel until they fit one prompt.
+        
+        Every intermediate round at least halves the number of sections, and
+        after MAX_REDUCE_ROUNDS rounds the remaining sections go into one
+        (truncated) final prompt, so long merged notes cannot keep the loop going.
+        
+        An intermediate round may use half of the time left before deadline;
+        groups not merged by then keep their extracts and go straight to the
+        final prompt. If the final prompt misses the deadline, the notes
+        gathered so far are returned instead.
+        """
+        # Own pool: map calls that could not be cancelled may still occupy the map pool
+        executor = ThreadPoolExecutor(max_workers=MAP_REDUCE_WORKERS, thread_name_prefix='gemini-reduce')
+        try:
+            for round_number in range(1, MAX_REDUCE_ROUNDS + 1):
+                groups = [[]]
+                size = 0
+                for section in sections:
+                    if groups[-1] and size + len(section) > MAX_CONTEXT_LENGTH:
+                        groups.append([])
+                        size = 0
+                    groups[-1].append(section)
+                    size += len(section)
+                
+                if len(groups) > (len(sections) + 1) // 2:
+                    # Sections too long to share a prompt: merge pairwise anyway
+                    # (the reduce prompt truncates) so the round makes progress
+                    groups = [sections[i:i + 2] for i in range(0, len(sections), 2)]
+                if len(groups) == 1 or round_number == MAX_REDUCE_ROUNDS:
+                    break
+                
+                # Intermediate round: each group is merged into one section
+                print(f"Reduce step: merging {len(sections)} extracts in {len(groups)} groups")
+                futures = [executor.submit(self._generate, self._reduce_prompt(user_query, group)) for group in groups]
+                timeout = None if deadline is None else max((deadline - time.monotonic()) / 2, 0)
+                done, not_done = wait(futures, timeout=timeout)
+                sections = []
+                for i, (group, future) in enumerate(zip(groups, futures)):
+                    if future in done and future.exception() is None:
+                        sections.append(f"--- Combined notes {i + 1} ---\n{future.result()}\n")
+                    else:
+                        # Not merged (failed or out of time): keep the extracts as they are
+                        future.cancel()
+                        sections.extend(group)
+                if not_done:
+                    print(f"Reduce step: {len(not_done)} groups not merged in time")
+                    break
+            
+            final = None
+            if deadline is None or time.monotonic() < deadline:
+                final = executor.submit(self._generate, self._reduce_prompt(user_query, sections))
+                done, _ = wait([final], timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+                if done:
+                    return final.result()
+            print("Reduce step: out of time, returning the extracted notes")
+            notes = "\n".join(sections)
+            if len(notes) > MAX_CONTEXT_LENGTH:
+                notes = notes[:MAX_CONTEXT_LENGTH] + "... [truncated]"
+            return f"The answer could not be completed in time. Notes extracted from the documents so far:\n\n{notes}"
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _reduce_prompt(self, user_query: str, sections: List[str]) -> str:
+        """Prompt that answers the question from map-step extracts."""
+        context = "\n".join(sections)
+        if len(context) > MAX_CONTEXT_LENGTH:
+            # A single oversized extract
+            context = context[:MAX_CONTEXT_LENGTH] + "... [truncated]"
+        return f"""The following notes were extracted from documents in Google Drive, each labelled with its source file:
+
+{context}
+
+---
+
+User Question: {user_query}
+
+Please provide a comprehensive answer that combines the notes above, citing source files. Keep every relevant item; do not drop items that appear in only one file. If the information is not available in the notes, please state that clearly."""
+    
+    def _build_prompt(self, user_query: str, context: str) -> str:
+        """Construct the RAG prompt, truncating context to MAX_CONTEXT_LENGTH."""
         # Truncate context if too long
         if len(context) > MAX_CONTEXT_LENGTH:
             context = context[:MAX_CONTEXT_LENGTH] + "... [truncated]"
         
         # Construct prompt with context
-        prompt = f"""You have access to the following documents from Google Drive:
+        return self._context_prefix(context) + self._question_suffix(user_query)
+    
+    def _context_prefix(self, context: str) -> str:
+        """Document part of the prompt; identical across queries for the same context."""
+        return f"""You have access to the following documents from Google Drive:
 
 {context}
 
 ---
 
-User Question: {user_query}
+"""
+    
+    def _question_suffix(self, user_query: str) -> str:
+        """Per-query part of the prompt."""
+        return f"""User Question: {user_query}
 
 Please provide a comprehensive answer based on the documents above. If the information is not available in the documents, please state that clearly."""
-        
-        try:
-            response = self.model.generate_content(prompt)
-            return response.text
-        except Exception as e:
-            error_msg = str(e)
-            # Check for rate limit/quota errors
-            if '429' in error_msg or 'quota' in error_msg.lower() or 'rate' in error_msg.lower():
-                if 'gemini-2.5-pro' in error_msg or 'gemini-2.0' in error_msg:
-                    return f"Error: The model requires a paid plan. Please change GEMINI_MODEL in config.py to 'gemini-flash-latest' or 'gemini-pro-latest' for free tier access."
-                else:
-                    return f"Error: Rate limit exceeded. Please wait a moment and try again. Details: {error_msg[:300]}"
-            # Check for 404 model not found errors
-            if '404' in error_msg and 'not found' in error_msg.lower():
-                return f"Error: Model not found. The configured model may not be available. Please check GEMINI_MODEL in config.py. Available free tier models: 'gemini-flash-latest' or 'gemini-pro-latest'. For premium models, a paid Google Cloud billing account is required. See CLIENT_PRICING_MESSAGE.md for details."
-            return f"Error querying Gemini: {error_msg}"
+    
+    def _format_error(self, e: Exception) -> str:
+        """Turn a Gemini API exception into a user-facing error message."""
+        error_msg = str(e)
+        # Check for rate limit/quota errors
+        if '429' in error_msg or 'quota' in error_msg.lower() or 'rate' in error_msg.lower():
+            if 'gemini-2.5-pro' in error_msg or 'gemini-2.0' in error_msg:
+                return f"Error: The model requires a paid plan. Please change GEMINI_MODEL in config.py to 'gemini-flash-latest' or 'gemini-pro-latest' for free tier access."
+            else:
+                return f"Error: Rate limit exceeded. Please wait a moment and try again. Details: {error_msg[:300]}"
+        # Check for 404 model not found errors
+        if '404' in error_msg and 'not found' in error_msg.lower():
+            return f"Error: Model not found. The configured model may not be available. Please check GEMINI_MODEL in config.py. Available free tier models: 'gemini-flash-latest' or 'gemini-pro-latest'. For premium models, a paid Google Cloud billing account is required. See CLIENT_PRICING_MESSAGE.md for details."
+        return f"Error querying Gemini: {error_msg}"
     
     def query(self, prompt: str) -> str:
         """
@@ -120,18 +442,69 @@ Please provide a comprehensive answer based on the documents above. If the infor
             Gemini's response
         """
         try:
-            response = self.model.generate_content(prompt)
-            return response.text
+            return self._generate(prompt)
         except Exception as e:
-            error_msg = str(e)
-            # Check for rate limit/quota errors
-            if '429' in error_msg or 'quota' in error_msg.lower() or 'rate' in error_msg.lower():
-                if 'gemini-2.5-pro' in error_msg or 'gemini-2.0' in error_msg:
-                    return f"Error: The model requires a paid plan. Please change GEMINI_MODEL in config.py to 'gemini-flash-latest' or 'gemini-pro-latest' for free tier access."
-                else:
-                    return f"Error: Rate limit exceeded. Please wait a moment and try again. Details: {error_msg[:300]}"
-            # Check for 404 model not found errors
-            if '404' in error_msg and 'not found' in error_msg.lower():
-                return f"Error: Model not found. The configured model may not be available. Please check GEMINI_MODEL in config.py. Available free tier models: 'gemini-flash-latest' or 'gemini-pro-latest'. For premium models, a paid Google Cloud billing account is required. See CLIENT_PRICING_MESSAGE.md for details."
-            return f"Error querying Gemini: {error_msg}"
-
+            return self._format_error(e)
+    
+    def _generate(self, prompt: str) -> str:
+        """Send one prompt under the rate limiter and return the response text."""
+        if self.hedge_policy is None:
+            return self._call_model(self.model, prompt)
+        return self._generate_hedged(prompt)
+    
+    def _call_model(self, model, prompt: str, started: threading.Event = None) -> str:
+        """
+        Call one model and record its latency.
+        
+        Args:
+            model: Model to call
+            prompt: Prompt text
+            started: Set once the rate limiter admits the call, i.e. when the
+                span recorded in the latency history begins
+        """
+        with self.rate_limiter:
+            if started is not None:
+                started.set()
+            with timed('generate_content') as span:
+                response = model.generate_content(prompt)
+            text = response.text
+        self.latency[getattr(model, 'model_name', '')].record(span.elapsed)
+        return text
+    
+    def _generate_hedged(self, prompt: str) -> str:
+        """
+        Send the prompt to the primary model and, if it is slower than the
+        hedge threshold, to the hedge target too; the first success wins.
+        """
+        models = {getattr(m, 'model_name', ''): m for m in (self.model, self.fallback_model) if m is not None}
+        primary_name, hedge_name = self.hedge_policy.order(list(models), self.latency)
+        self.hedge_policy.on_request()
+        
+        started = threading.Event()
+        primary = self._hedge_executor.submit(self._call_model, models[primary_name], prompt, started)
+        delay = self.hedge_policy.hedge_delay(self.latency[primary_name])
+        if delay is None:
+            return primary.result()
+        # The threshold is model latency, so count from when the call actually
+        # starts, not from time spent queued for the executor or rate limiter
+        primary.add_done_callback(lambda _: started.set())
+        started.wait()
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.hedge_policy.try_spend():
+            return primary.result()
+        
+        hedge = self._hedge_executor.submit(self._call_model, models[hedge_name], prompt)
+        HEDGED_REQUESTS.inc(model=hedge_name, result='sent')
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The slower call cannot be interrupted mid-flight; its
+                    # result is discarded (it still feeds the latency history)
+                    for other in pending:
+                        other.cancel()
+                    HEDGED_REQUESTS.inc(model=hedge_name, result='hedge_won' if future is hedge else 'primary_won')
+                    return future.result()
+        HEDGED_REQUESTS.inc(model=hedge_name, result='failed')
+        return primary.result()
@@ -0,0 +1,120 @@
+"""
+Hedged-request policy for Gemini calls.
+Tracks recent latency per model. A call still running past a high
+percentile of that latency gets a second (hedge) request, within a budget
+that caps the extra traffic.
+"""
+import threading
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+from metrics import percentile
+
+
+class LatencyHistory:
+    """
+    Sliding window of recent successful call latencies for one model.
+
+    Samples older than max_age seconds are ignored, so a model that stopped
+    receiving traffic (e.g. after failover) loses its stale latency and is
+    tried again.
+    """
+
+    def __init__(self, size: int = 256, max_age: float = 300.0):
+        # (time.monotonic() when recorded, seconds)
+        self._samples = deque(maxlen=size)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append((time.monotonic(), seconds))
+
+    def _recent(self) -> List[float]:
+        """Latencies younger than max_age; caller holds the lock."""
+        cutoff = time.monotonic() - self.max_age
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+        return [seconds for _, seconds in self._samples]
+
+    def percentile(self, pct: float, min_samples: int = 1) -> Optional[float]:
+        """Return the pct-th percentile, or None with fewer than min_samples recent samples."""
+        with self._lock:
+            samples = self._recent()
+        if len(samples) < max(min_samples, 1):
+            return None
+        return percentile(samples, pct)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._recent())
+
+
+class HedgePolicy:
+    """Decides when to hedge, which model to use, and how many hedges are affordable."""
+
+    def __init__(self, hedge_percentile: float = 95, min_samples: int = 20,
+                 min_delay: float = 0.25, budget_ratio: float = 0.1,
+                 failover_ratio: float = 2.0):
+        """
+        Args:
+            hedge_percentile: Latency percentile after which a hedge is sent
+            min_samples: Samples needed before a model's latency is trusted
+            min_delay: Never hedge sooner than this many seconds
+            budget_ratio: Hedges allowed per primary request (0.1 = at most ~10% extra calls)
+            failover_ratio: Prefer the fallback model when the primary's median
+                latency is this many times slower
+        """
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budget_ratio = budget_ratio
+        self.failover_ratio = failover_ratio
+        # Token bucket: every request earns budget_ratio, every hedge spends 1
+        self._credits = 1.0
+        self._max_credits = max(1.0, budget_ratio * 100)
+        self._lock = threading.Lock()
+
+    def hedge_delay(self, history: LatencyHistory) -> Optional[float]:
+        """Seconds to wait before hedging, or None if there is no latency history yet."""
+        threshold = history.percentile(self.hedge_percentile, self.min_samples)
+        if threshold is None:
+            return None
+        return max(threshold, self.min_delay)
+
+    def on_request(self):
+        """Earn hedge budget for a primary request."""
+        with self._lock:
+            self._credits = min(self._credits + self.budget_ratio, self._max_credits)
+
+    def try_spend(self) -> bool:
+        """Take budget for one hedge; False if the budget is exhausted."""
+        with self._lock:
+            if self._credits < 1.0:
+                return False
+            self._credits -= 1.0
+            return True
+
+    def order(self, names: List[str], histories) -> Tuple[str, str]:
+        """
+        Pick (primary, hedge target) model names.
+
+        Args:
+            names: Configured model first, then the fallback (if any)
+            histories: Mapping of model name to LatencyHistory
+
+        Returns:
+            The primary and hedge model names; they are the same model when
+            no fallback is configured
+        """
+        if len(names) < 2:
+            return names[0], names[0]
+        primary, fallback = names[0], names[1]
+        primary_p50 = histories[primary].percentile(50, self.min_samples)
+        fallback_p50 = histories[fallback].percentile(50, self.min_samples)
+        if primary_p50 is not None and fallback_p50 is not None \
+                and primary_p50 > self.failover_ratio * fallback_p50:
+            # Latency-based failover: the fallback has been much faster lately.
+            # Once the configured model's samples age out it is primary again.
+            return fallback, primary
+        return primary, fallback
@@ -0,0 +1,203 @@
+"""
+Load generator for the Flask API.
+Drives /api/query and /api/status at a sweep of concurrency levels and reports
+throughput, tail latency and error rate per level.
+
+Usage:
+    # Against the app started in-process on fake backends (threaded dev server)
+    python load_test.py --concurrency 1,4,16,64 --duration 10
+
+    # Against any running server, e.g. started with USE_FAKE_BACKENDS=1
+    python load_test.py --url http://localhost:8000 --concurrency 1,8,32
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+from urllib.parse import urlparse
+
+from metrics import percentile
+
+DEFAULT_QUERIES = [
+    "What are the main topics in these documents?",
+    "Summarize the key points",
+    "List any action items mentioned",
+    "What deadlines are mentioned?",
+]
+
+
+class _Worker(threading.Thread):
+    """Sends requests over one keep-alive connection until the stop event is set."""
+
+    def __init__(self, base_url: str, queries: List[str], status_ratio: float,
+                 stop: threading.Event, timeout: float, seed: int):
+        super().__init__(daemon=True)
+        self.parsed = urlparse(base_url)
+        self.queries = queries
+        self.status_ratio = status_ratio
+        self.stop = stop
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        # endpoint -> list of (latency_seconds, ok)
+        self.samples = {'/api/query': [], '/api/status': []}
+        self.conn = None
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(
+                self.parsed.hostname, self.parsed.port or 80, timeout=self.timeout
+            )
+        return self.conn
+
+    def _send(self, method: str, path: str, body: bytes = None) -> int:
+        headers = {'Content-Type': 'application/json'} if body else {}
+        conn = self._connection()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            payload = response.read()
+        except Exception:
+            conn.close()
+            self.conn = None
+            raise
+        if response.status == 200 and path == '/api/query':
+            # The API reports Gemini failures inside a 200 body, as an answer starting with 'Error'
+            if json.loads(payload).get('response', '').startswith('Error'):
+                return 500
+        return response.status
+
+    def run(self):
+        while not self.stop.is_set():
+            if self.rng.random() < self.status_ratio:
+                path, method, body = '/api/status', 'GET', None
+            else:
+                query = self.rng.choice(self.queries)
+                path, method, body = '/api/query', 'POST', json.dumps({'query': query}).encode('utf-8')
+
+            start = time.perf_counter()
+            try:
+                ok = self._send(method, path, body) == 200
+            except Exception:
+                ok = False
+            self.samples[path].append((time.perf_counter() - start, ok))
+
+
+def _summarize(samples: List, duration: float) -> Dict:
+    latencies = [latency for latency, _ in samples]
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / duration, 2) if duration else 0.0,
+        'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p90_ms': round(percentile(latencies, 90) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def run_level(base_url: str, concurrency: int, args) -> Dict:
+    """Run one concurrency level for args.duration seconds."""
+    stop = threading.Event()
+    workers = [
+        _Worker(base_url, args.queries, args.status_ratio, stop, args.timeout, seed=args.seed + i)
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    time.sleep(args.duration)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    by_endpoint = {}
+    combined = []
+    for path in ('/api/query', '/api/status'):
+        samples = [s for worker in workers for s in worker.samples[path]]
+        combined.extend(samples)
+        by_endpoint[path] = _summarize(samples, elapsed)
+
+    result = {'concurrency': concurrency, 'duration_seconds': round(elapsed, 3)}
+    result.update(_summarize(combined, elapsed))
+    result['endpoints'] = by_endpoint
+    return result
+
+
+def start_local_server(args) -> str:
+    """Start the app on fake backends in a background threaded dev server."""
+    os.environ['USE_FAKE_BACKENDS'] = '1'
+    os.environ.setdefault('FAKE_CORPUS_SIZE', str(args.corpus_size))
+    os.environ.setdefault('FAKE_GEMINI_LATENCY_MS', str(args.gemini_latency_ms))
+
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    app_module.initialize_connectors()
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrency sweep load test for /api/query and /api/status.")
+    parser.add_argument('--url', help="Base URL of a running server (default: start the app in-process on fake backends)")
+    parser.add_argument('--concurrency', default='1,4,16,64', help="Comma-separated concurrency levels")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds to run each level")
+    parser.add_argument('--status-ratio', type=float, default=0.1, help="Fraction of requests sent to /api/status")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument('--query', action='append', dest='queries', help="Query text to send (repeatable)")
+    parser.add_argument('--corpus-size', type=int, default=200, help="Synthetic corpus size for the in-process server")
+    parser.add_argument('--gemini-latency-ms', type=float, default=500.0,
+                        help="Fake Gemini latency for the in-process server")
+    parser.add_argument('--label', default='', help="Free-form label for the server mode under test")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+    args.queries = args.queries or DEFAULT_QUERIES
+
+    base_url = args.url or start_local_server(args)
+    print(f"Load testing {base_url}", file=sys.stderr)
+
+    levels = []
+    for concurrency in [int(c) for c in args.concurrency.split(',') if c.strip()]:
+        result = run_level(base_url, concurrency, args)
+        levels.append(result)
+        print(
+            f"  c={concurrency:<4} {result['throughput_rps']:>8.1f} req/s  "
+            f"p50 {result['p50_ms']:.1f}ms  p99 {result['p99_ms']:.1f}ms  "
+            f"errors {result['error_rate']:.2%}",
+            file=sys.stderr
+        )
+
+    report = {
+        'benchmark': 'gdrive-gemini-load',
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'target': base_url,
+        'label': args.label or ('in-process threaded dev server' if not args.url else ''),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'url')},
+        'levels': levels,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+Provides counters, gauges, histograms and a timing span helper for the
+ingest and query paths. With a multiprocess directory enabled, each process
+writes its metrics to a file there and a scrape of any worker merges them.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+from config import METRICS_MULTIPROC_DIR
+
+# Latency buckets in seconds, from sub-millisecond index work up to slow LLM calls
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> Tuple[str, ...]:
+    """Build a hashable label tuple in declaration order."""
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames: Tuple[str, ...], key: Tuple[str, ...], extra: str = '') -> str:
+    """Format a label set as {a="x",b="y"}."""
+    parts = []
+    for name, value in zip(labelnames, key):
+        escaped = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class Counter:
+    """Monotonically increasing counter."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        """Increase the counter by amount."""
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Return the current value for a label set."""
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in items
+        ]
+
+    def empty_copy(self):
+        return type(self)(self.name, self.documentation, self.labelnames)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def snapshot(self) -> List:
+        """JSON-serializable values, for merging across processes."""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def merge(self, items: List):
+        """Add another process's snapshot."""
+        with self._lock:
+            for key, value in items:
+                key = tuple(key)
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        """Set the gauge to value."""
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def merge(self, items: List):
+        """Combine another process's snapshot, keeping the largest value (workers share one corpus)."""
+        with self._lock:
+            for key, value in items:
+                key = tuple(key)
+                self._values[key] = max(self._values.get(key, value), value)
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """Record one observation."""
+        key = _label_key(self.labelnames, labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[key] = series
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        """Return the number of observations for a label set."""
+        series = self._series.get(_label_key(self.labelnames, labels))
+        return series[2] if series else 0
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+        lines = []
+        for key, bucket_counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+    def empty_copy(self):
+        return Histogram(self.name, self.documentation, self.labelnames, self.buckets)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self) -> List:
+        """JSON-serializable series, for merging across processes."""
+        with self._lock:
+            return [[list(key), list(s[0]), s[1], s[2]] for key, s in self._series.items()]
+
+    def merge(self, items: List):
+        """Add another process's snapshot."""
+        with self._lock:
+            for key, bucket_counts, total, count in items:
+                series = self._series.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0, 0])
+                series[0] = [a + b for a, b in zip(series[0], bucket_counts)]
+                series[1] += total
+                series[2] += count
+
+
+class Registry:
+    """Holds all metrics and renders them in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def metrics(self) -> List:
+        with self._lock:
+            return list(self._metrics)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        metrics = self.metrics()
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'gdrive_gemini_stage_seconds',
+    'Time spent in each ingest and query stage.',
+    ('stage',)
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    'gdrive_gemini_stage_errors_total',
+    'Exceptions raised inside a timed stage.',
+    ('stage',)
+))
+BYTES_DOWNLOADED = REGISTRY.register(Counter(
+    'gdrive_gemini_drive_bytes_downloaded_total',
+    'Bytes downloaded or exported from Google Drive.'
+))
+FILES_PROCESSED = REGISTRY.register(Counter(
+    'gdrive_gemini_drive_files_processed_total',
+    'Drive files processed during ingest, by outcome.',
+    ('outcome',)
+))
+CHUNKS_INDEXED = REGISTRY.register(Counter(
+    'gdrive_gemini_chunks_indexed_total',
+    'Chunks created by the RAG processor.'
+))
+DOCUMENTS_LOADED = REGISTRY.register(Gauge(
+    'gdrive_gemini_documents_loaded',
+    'Documents currently held by the RAG processor.'
+))
+CHUNKS_LOADED = REGISTRY.register(Gauge(
+    'gdrive_gemini_chunks_loaded',
+    'Chunks currently held by the RAG processor.'
+))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'gdrive_gemini_cache_requests_total',
+    'Cache lookups by cache name and result (hit or miss).',
+    ('cache', 'result')
+))
+QUERIES = REGISTRY.register(Counter(
+    'gdrive_gemini_queries_total',
+    'Queries handled by /api/query, by outcome.',
+    ('outcome',)
+))
+HEDGED_REQUESTS = REGISTRY.register(Counter(
+    'gdrive_gemini_hedged_requests_total',
+    'Hedged Gemini calls by model hedged to and result (sent, hedge_won, primary_won, failed).',
+    ('model', 'result')
+))
+
+
+class timed:
+    """
+    Context manager that records the duration of a stage.
+
+    Usage:
+        with timed('retrieve'):
+            ...
+    """
+
+    __slots__ = ('stage', 'start', 'elapsed')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.start = 0.0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(self.elapsed, stage=self.stage)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.stage)
+        return False
+
+
+def record_cache(cache: str, hit: bool):
+    """Record a cache lookup for hit-rate reporting."""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+# Directory shared by the worker processes of one server, or None
+_multiprocess_dir = None
+# Seconds between background writes of this process's metrics file
+FLUSH_INTERVAL = 1.0
+
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(_multiprocess_dir, f"metrics-{pid}.json")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def write_snapshot():
+    """Write this process's metrics to the multiprocess directory (atomically)."""
+    if _multiprocess_dir is None:
+        return
+    data = {metric.name: metric.snapshot() for metric in REGISTRY.metrics()}
+    fd, tmp_path = tempfile.mkstemp(dir=_multiprocess_dir, prefix='.metrics-', suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, _snapshot_path(os.getpid()))
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            write_snapshot()
+        except OSError as e:
+            print(f"⚠️  Could not write metrics snapshot: {e}")
+
+
+def _start_flusher():
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _after_fork_in_child():
+    # The parent's counts stay in the parent's file; count only this worker's work from here
+    for metric in REGISTRY.metrics():
+        metric.reset()
+    write_snapshot()
+    _start_flusher()
+
+
+def enable_multiprocess(directory: str):
+    """
+    Aggregate metrics across the processes of a pre-forking server.
+
+    Every process (the preloading parent and each forked worker) writes its
+    metrics to directory; /metrics on any worker returns their merged total.
+    Counters and histograms are summed, including those of exited workers, so
+    they stay monotonic; gauges take the largest value among live processes.
+    Files left by dead processes of an earlier run are removed.
+
+    Args:
+        directory: Directory shared by the server's processes
+    """
+    global _multiprocess_dir
+    if _multiprocess_dir is not None:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _multiprocess_dir = directory
+    for name in os.listdir(directory):
+        if name.startswith('metrics-') and name.endswith('.json'):
+            pid = int(name[len('metrics-'):-len('.json')])
+            if pid != os.getpid() and not _pid_alive(pid):
+                os.remove(os.path.join(directory, name))
+    # Save the parent's state before each fork (e.g. preload ingest metrics)
+    os.register_at_fork(before=write_snapshot, after_in_child=_after_fork_in_child)
+    _start_flusher()
+
+
+def render_latest() -> str:
+    """Render the default registry, merged across processes when multiprocess mode is on."""
+    if _multiprocess_dir is None:
+        return REGISTRY.render()
+
+    write_snapshot()
+    merged = Registry()
+    by_name = {metric.name: merged.register(metric.empty_copy()) for metric in REGISTRY.metrics()}
+    for name in sorted(os.listdir(_multiprocess_dir)):
+        if not (name.startswith('metrics-') and name.endswith('.json')):
+            continue
+        pid = int(name[len('metrics-'):-len('.json')])
+        try:
+            with open(os.path.join(_multiprocess_dir, name)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = _pid_alive(pid)
+        for metric_name, items in data.items():
+            metric = by_name.get(metric_name)
+            if metric is None or (metric.kind == 'gauge' and not alive):
+                continue
+            metric.merge(items)
+    return merged.render()
+
+
+CONTENT_TYPE_LATEST = 'text/plain; version=0.0.4; charset=utf-8'
+
+if METRICS_MULTIPROC_DIR:
+    enable_multiprocess(METRICS_MULTIPROC_DIR)
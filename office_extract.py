@@ -0,0 +1,105 @@
+"""
+Local text extraction for Microsoft Office files downloaded from Google Drive.
+Drive can only export native Google formats, so uploaded .docx and .xlsx files
+are downloaded as-is and parsed here. The functions are module-level so they
+can run in a process pool.
+"""
+import csv
+import io
+import zipfile
+from xml.etree import ElementTree
+
+DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+XLSX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+OFFICE_MIME_TYPES = (DOCX_MIME_TYPE, XLSX_MIME_TYPE)
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def extract_docx(data: bytes) -> str:
+    """
+    Extract paragraph text from a .docx file by streaming its document XML.
+
+    Table cells are separated by tabs and each table row ends a line.
+
+    Args:
+        data: Raw .docx bytes
+
+    Returns:
+        Document text, one paragraph per line
+    """
+    lines = []
+    paragraph = []
+    # Open table rows and cells (tables can nest)
+    rows = []
+    cells = []
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        with archive.open('word/document.xml') as xml:
+            for event, element in ElementTree.iterparse(xml, events=('start', 'end')):
+                tag = element.tag
+                if event == 'start':
+                    if tag == _W + 'tr':
+                        rows.append([])
+                    elif tag == _W + 'tc':
+                        cells.append([])
+                    continue
+
+                if tag == _W + 't':
+                    paragraph.append(element.text or '')
+                elif tag == _W + 'tab':
+                    paragraph.append('\t')
+                elif tag in (_W + 'br', _W + 'cr'):
+                    paragraph.append('\n')
+                elif tag == _W + 'p':
+                    (cells[-1] if cells else lines).append(''.join(paragraph))
+                    paragraph = []
+                elif tag == _W + 'tc':
+                    rows[-1].append(' '.join(text for text in cells.pop() if text))
+                elif tag == _W + 'tr':
+                    (cells[-1] if cells else lines).append('\t'.join(rows.pop()))
+                elif tag == _W + 'body':
+                    break
+                # Free parsed elements as we go; document XML can be large
+                element.clear()
+    return '\n'.join(lines)
+
+
+def extract_xlsx(data: bytes) -> str:
+    """
+    Extract cell values from an .xlsx workbook with openpyxl's read-only reader.
+
+    Args:
+        data: Raw .xlsx bytes
+
+    Returns:
+        CSV text of the workbook. A single-sheet workbook is plain CSV;
+        otherwise each sheet is preceded by a "Sheet: <name>" line.
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        sheets = []
+        for sheet in workbook.worksheets:
+            out = io.StringIO()
+            writer = csv.writer(out, lineterminator='\n')
+            for row in sheet.iter_rows(values_only=True):
+                if any(value is not None for value in row):
+                    writer.writerow(['' if value is None else value for value in row])
+            if out.tell():
+                sheets.append((sheet.title, out.getvalue()))
+    finally:
+        workbook.close()
+
+    if len(sheets) == 1:
+        return sheets[0][1]
+    return '\n'.join(f"Sheet: {title}\n{text}" for title, text in sheets)
+
+
+def extract_office(mime_type: str, data: bytes) -> str:
+    """Dispatch to the extractor for an Office MIME type."""
+    if mime_type == DOCX_MIME_TYPE:
+        return extract_docx(data)
+    if mime_type == XLSX_MIME_TYPE:
+        return extract_xlsx(data)
+    raise ValueError(f"No local extractor for {mime_type}")
@@ -0,0 +1,189 @@
+"""
+On-demand CPU and memory profiling for the ingest and query paths.
+A ProfileSession samples Python stacks from a background thread and,
+optionally, diffs tracemalloc snapshots around one call. Results come back as
+top functions, allocation sites, per-document extraction cost and folded
+stacks that flamegraph.pl, speedscope and similar tools read directly.
+Nothing is installed or sampled unless a session is running.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+
+# The session currently running, if any; checked by instrumented code
+_active = None
+_active_lock = threading.Lock()
+_thread_start = threading.Thread.start
+
+
+def active_session() -> Optional['ProfileSession']:
+    """Return the running session, or None (the common, zero-cost case)."""
+    return _active
+
+
+def _tracking_start(thread: threading.Thread):
+    """Thread.start while a session runs: adopt threads started by profiled threads."""
+    _thread_start(thread)
+    session = _active
+    if session is not None and threading.current_thread() in session._threads:
+        session._threads.add(thread)
+
+
+class ProfileSession:
+    """Samples stacks and memory while one function runs."""
+
+    def __init__(self, interval: float = 0.005, memory: bool = True, top: int = 25):
+        """
+        Args:
+            interval: Seconds between stack samples
+            memory: Also trace allocations with tracemalloc (slows the profiled code)
+            top: Number of functions and allocation sites to report
+        """
+        self.interval = interval
+        self.memory = memory
+        self.top = top
+        self.stacks = Counter()
+        self.samples = 0
+        self.documents: List[Dict] = []
+        self.wall_seconds = 0.0
+        self._documents_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = set()
+        self._memory_report = {}
+
+    def record_document(self, file_id: str, name: str, mime_type: str,
+                        seconds: float, cpu_seconds: float, chars: int):
+        """Record the extraction cost of one document (called from ingest threads)."""
+        with self._documents_lock:
+            self.documents.append({
+                'file_id': file_id,
+                'name': name,
+                'mime_type': mime_type,
+                'seconds': round(seconds, 6),
+                'cpu_seconds': round(cpu_seconds, 6),
+                'chars': chars,
+            })
+
+    def _sample(self):
+        """Sampler thread: fold the stack of every thread started for the profiled work."""
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread in list(self._threads):
+                frame = frames.get(thread.ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def run(self, fn: Callable):
+        """
+        Run fn under the profiler.
+
+        Only the calling thread and threads it starts, directly or through
+        other such threads, while fn runs (e.g. download or map-reduce
+        workers) are sampled. Server threads handling other requests are left
+        out, as is work fn hands to pool threads that already existed.
+
+        Returns:
+            fn's return value
+        """
+        global _active
+        with _active_lock:
+            if _active is not None:
+                raise RuntimeError('A profiling session is already running')
+            _active = self
+
+        self._threads = {threading.current_thread()}
+        started_tracing = False
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+            started_tracing = True
+        baseline = tracemalloc.take_snapshot() if self.memory else None
+        if self.memory:
+            tracemalloc.reset_peak()
+
+        sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+        start = time.perf_counter()
+        sampler.start()
+        threading.Thread.start = _tracking_start
+        try:
+            return fn()
+        finally:
+            self.wall_seconds = time.perf_counter() - start
+            threading.Thread.start = _thread_start
+            self._stop.set()
+            sampler.join()
+            if self.memory:
+                self._memory_report = self._memory_diff(baseline)
+                if started_tracing:
+                    tracemalloc.stop()
+            with _active_lock:
+                _active = None
+
+    def _memory_diff(self, baseline) -> Dict:
+        """Top allocation sites by growth since the baseline snapshot."""
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ])
+        stats = snapshot.compare_to(baseline, 'lineno')
+        return {
+            'peak_traced_bytes': tracemalloc.get_traced_memory()[1],
+            'allocations': [
+                {
+                    'site': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    'size_diff_bytes': stat.size_diff,
+                    'size_bytes': stat.size,
+                    'count_diff': stat.count_diff,
+                }
+                for stat in stats[:self.top]
+            ],
+        }
+
+    def top_functions(self) -> List[Dict]:
+        """Functions by self time (leaf samples), with inclusive time."""
+        self_counts = Counter()
+        total_counts = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            self_counts[frames[-1]] += count
+            for function in set(frames):
+                total_counts[function] += count
+        thread_samples = sum(self.stacks.values()) or 1
+        return [
+            {
+                'function': function,
+                'self_samples': count,
+                'self_pct': round(100.0 * count / thread_samples, 2),
+                'total_samples': total_counts[function],
+                'total_pct': round(100.0 * total_counts[function] / thread_samples, 2),
+            }
+            for function, count in self_counts.most_common(self.top)
+        ]
+
+    def folded(self) -> str:
+        """Stacks in collapsed ("folded") format: frame;frame;frame count."""
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+    def report(self, target: str) -> Dict:
+        """Summarize the session as a JSON-serializable dict."""
+        result = {
+            'target': target,
+            'wall_seconds': round(self.wall_seconds, 6),
+            'interval_ms': self.interval * 1000,
+            'samples': self.samples,
+            'top_functions': self.top_functions(),
+            'documents': sorted(self.documents, key=lambda d: d['seconds'], reverse=True),
+            'folded': self.folded(),
+        }
+        result.update(self._memory_report)
+        return result
@@ -1,8 +1,72 @@
 """
 RAG (Retrieval-Augmented Generation) processor for chunking and retrieving documents.
 """
-from typing import List, Dict
-from config import CHUNK_SIZE, CHUNK_OVERLAP
+import hashlib
+import html
+import re
+from array import array
+from typing import List, Dict, Union
+from config import (
+    CHUNK_SIZE, CHUNK_OVERLAP, CORPUS_CONTEXT_LENGTH,
+    PASSAGE_EXTRACTION, PASSAGE_WINDOW_SENTENCES, PASSAGE_MAX_CHARS,
+    TABLE_STORE, TABLE_MAX_ROWS
+)
+from metrics import timed, CHUNKS_INDEXED, DOCUMENTS_LOADED, CHUNKS_LOADED
+
+
+# Sentence boundaries: end punctuation followed by whitespace, or line breaks
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n+')
+TERM = re.compile(r'\w+')
+
+# Documents parsed into the columnar table store
+TABULAR_MIME_TYPES = (
+    'text/csv',
+    'application/vnd.google-apps.spreadsheet',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+)
+
+
+def content_hash(text: str) -> str:
+    """Return a stable hash identifying identical content."""
+    return hashlib.blake2b(text.encode('utf-8', errors='ignore'), digest_size=16).hexdigest()
+
+
+def index_sentences(text: str):
+    """
+    Precompute sentence offsets and term positions for passage extraction.
+    
+    Args:
+        text: Chunk text
+    
+    Returns:
+        (sentence start offsets, {term: bitmask of sentence indices containing it})
+    """
+    starts = array('I', [0])
+    starts.extend(m.end() for m in SENTENCE_BOUNDARY.finditer(text) if m.end() < len(text))
+    term_sentences = {}
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(text)
+        bit = 1 << i
+        for term in set(TERM.findall(text[start:end].lower())):
+            term_sentences[term] = term_sentences.get(term, 0) | bit
+    return starts, term_sentences
+
+
+def _subtract_ranges(start: int, end: int, ranges: List[tuple]) -> List[tuple]:
+    """Parts of [start, end) not covered by any of the given (start, end) ranges."""
+    pieces = [(start, end)]
+    for covered_start, covered_end in ranges:
+        remaining = []
+        for piece_start, piece_end in pieces:
+            if covered_end <= piece_start or covered_start >= piece_end:
+                remaining.append((piece_start, piece_end))
+                continue
+            if piece_start < covered_start:
+                remaining.append((piece_start, covered_start))
+            if covered_end < piece_end:
+                remaining.append((covered_end, piece_end))
+        pieces = remaining
+    return pieces
 
 
 class RAGProcessor:
@@ -10,51 +74,138 @@ class RAGProcessor:
     
     def __init__(self):
         """Initialize RAG processor."""
+        # file id -> {'name', 'mime_type', 'content', 'content_hash'}
         self.documents = {}
+        # content hash -> file ids sharing that content
+        self.content_files = {}
         self.chunks = []
+        # Identifies the loaded corpus; changes whenever any file or its content does
+        self.corpus_version = ''
+        self._all_content = None
+        # content hash -> table_store.Table for CSV files and Sheets
+        self.tables = {}
     
-    def load_documents(self, documents: Dict[str, str]):
+    def load_documents(self, documents: Dict[str, Union[Dict, str]]):
         """
         Load documents and create chunks.
         
+        Identical documents are stored once and chunked once; every file that
+        shares the content is kept for citations.
+        
         Args:
-            documents: Dictionary mapping file names to content
+            documents: Dictionary mapping file IDs to document records
+                ({'name', 'mime_type', 'content'}), as returned by
+                DriveConnector.get_all_documents. Plain strings are also
+                accepted, in which case the key doubles as the display name.
         """
-        self.documents = documents
-        self.chunks = self._create_chunks(documents)
-        print(f"Created {len(self.chunks)} chunks from {len(documents)} documents")
+        self.documents = {}
+        self.content_files = {}
+        canonical = {}
+        
+        for file_id, document in documents.items():
+            if isinstance(document, str):
+                document = {'name': file_id, 'mime_type': '', 'content': document}
+            digest = document.get('content_hash') or content_hash(document['content'])
+            # Keep a single copy of each distinct content
+            text = canonical.setdefault(digest, document['content'])
+            self.documents[file_id] = {
+                'name': document.get('name', file_id),
+                'mime_type': document.get('mime_type', ''),
+                'content': text,
+                'content_hash': digest,
+            }
+            self.content_files.setdefault(digest, []).append(file_id)
+        
+        self.corpus_version = content_hash('\n'.join(
+            f"{file_id}\t{doc['name']}\t{doc['content_hash']}"
+            for file_id, doc in sorted(self.documents.items())
+        ))
+        self._all_content = None
+        
+        if TABLE_STORE:
+            with timed('build_tables'):
+                self.tables = self._build_tables()
+        
+        with timed('create_chunks'):
+            self.chunks = self._create_chunks()
+        CHUNKS_INDEXED.inc(len(self.chunks))
+        DOCUMENTS_LOADED.set(len(self.documents))
+        CHUNKS_LOADED.set(len(self.chunks))
+        print(
+            f"Created {len(self.chunks)} chunks from {len(self.documents)} documents "
+            f"({len(self.content_files)} unique)"
+        )
+    
+    def _build_tables(self) -> Dict:
+        """Parse tabular documents into columnar tables, once per unique content."""
+        from table_store import parse_table
+        
+        tables = {}
+        for digest, file_ids in self.content_files.items():
+            document = self.documents[file_ids[0]]
+            if document['mime_type'] in TABULAR_MIME_TYPES:
+                table = parse_table(document['content'])
+                if table is not None:
+                    tables[digest] = table
+        if tables:
+            print(f"Indexed {len(tables)} tables ({sum(t.row_count for t in tables.values())} rows)")
+        return tables
     
-    def _create_chunks(self, documents: Dict[str, str]) -> List[Dict]:
+    def _create_chunks(self) -> List[Dict]:
         """
-        Split documents into chunks for better retrieval.
+        Split unique document contents into chunks for better retrieval.
+        
+        Chunks with identical text (across or within documents) are indexed
+        once and list every file they appear in.
         
-        Args:
-            documents: Dictionary mapping file names to content
-            
         Returns:
             List of chunk dictionaries with metadata
         """
         chunks = []
+        seen = {}
         
-        for file_name, content in documents.items():
+        for digest, file_ids in self.content_files.items():
+            content = self.documents[file_ids[0]]['content']
+            
             # Split content into chunks
             start = 0
             while start < len(content):
                 end = start + CHUNK_SIZE
                 chunk_text = content[start:end]
+                chunk_hash = content_hash(chunk_text)
                 
-                chunks.append({
-                    'file': file_name,
-                    'content': chunk_text,
-                    'start': start,
-                    'end': min(end, len(content))
-                })
+                existing = seen.get(chunk_hash)
+                if existing is not None:
+                    existing['file_ids'].extend(
+                        f for f in file_ids if f not in existing['file_ids']
+                    )
+                else:
+                    chunk = {
+                        'file': self.documents[file_ids[0]]['name'],
+                        'file_id': file_ids[0],
+                        'file_ids': list(file_ids),
+                        'content': chunk_text,
+                        'content_hash': chunk_hash,
+                        'start': start,
+                        'end': min(end, len(content))
+                    }
+                    if PASSAGE_EXTRACTION:
+                        chunk['sentences'], chunk['term_sentences'] = index_sentences(chunk_text)
+                    seen[chunk_hash] = chunk
+                    chunks.append(chunk)
                 
                 # Move start position with overlap
                 start = end - CHUNK_OVERLAP
         
         return chunks
     
+    def file_label(self, file_ids: List[str]) -> str:
+        """Format the display names of files sharing the same content."""
+        names = [self.documents[f]['name'] for f in file_ids if f in self.documents]
+        if len(names) > 1:
+            return f"{names[0]} (also in: {', '.join(names[1:])})"
+        return names[0] if names else ''
+    
     def retrieve_relevant_chunks(self, query: str, top_k: int = 5) -> str:
         """
         Retrieve most relevant chunks based on query.
@@ -63,51 +214,289 @@ class RAGProcessor:
         Args:
             query: User query
             top_k: Number of top chunks to retrieve
-            
+        
         Returns:
             Combined relevant context
         """
         if not self.chunks:
             return ""
         
+        with timed('retrieve'):
+            return self._retrieve(query, top_k)
+    
+    def map_reduce_chunks(self, query: str, limit: int) -> List[Dict]:
+        """
+        Chunks to read in map-reduce mode: all of them when there are at most
+        limit, otherwise the limit best-matching chunks (topped up with
+        non-matching ones in corpus order), returned in corpus order.
+        """
+        if len(self.chunks) <= limit:
+            return self.chunks
+        selected = {id(chunk) for _, chunk in self._score_chunks(query, self.chunks)[:limit]}
+        for chunk in self.chunks:
+            if len(selected) >= limit:
+                break
+            selected.add(id(chunk))
+        print(f"Map-reduce: reading {len(selected)} of {len(self.chunks)} chunks (MAP_REDUCE_MAX_CHUNKS)")
+        return [chunk for chunk in self.chunks if id(chunk) in selected]
+    
+    def _score_chunks(self, query: str, chunks: List[Dict]) -> List[tuple]:
+        """Score chunks against the query; returns (score, chunk) pairs, best first."""
         # Simple keyword-based retrieval
         # In production, you'd use embeddings and vector similarity
-        query_lower = query.lower()
-        query_words = set(query_lower.split())
+        # Words, not whitespace-separated tokens, so punctuation and CSV
+        # delimiters do not hide matches
+        query_words = set(TERM.findall(query.lower()))
         
         scored_chunks = []
-        for chunk in self.chunks:
-            chunk_lower = chunk['content'].lower()
-            chunk_words = set(chunk_lower.split())
+        for chunk in chunks:
+            # The passage index already holds the chunk's words
+            term_sentences = chunk.get('term_sentences')
+            if term_sentences is not None:
+                chunk_words = term_sentences.keys()
+            else:
+                chunk_words = set(TERM.findall(chunk['content'].lower()))
             
             # Calculate simple relevance score (word overlap)
             common_words = query_words.intersection(chunk_words)
             score = len(common_words) / max(len(query_words), 1)
             
-            scored_chunks.append((score, chunk))
+            # Chunks sharing no words with the query are not context; an
+            # empty result lets the caller fall back to the whole corpus
+            if score > 0:
+                scored_chunks.append((score, chunk))
         
-        # Sort by score and get top_k
+        # Sort by score
         scored_chunks.sort(reverse=True, key=lambda x: x[0])
-        top_chunks = scored_chunks[:top_k]
+        return scored_chunks
+    
+    def _retrieve(self, query: str, top_k: int) -> str:
+        """Score all chunks against the query and combine the top_k."""
+        top_chunks = self._score_chunks(query, self.chunks)[:top_k]
         
-        # Combine top chunks
+        # Combine top chunks, keeping only the passages that match the query
+        query_terms = set(TERM.findall(query.lower()))
         context_parts = []
+        tables_used = set()
+        # content hash -> absolute (start, end) ranges already in the prompt
+        emitted = {}
         for score, chunk in top_chunks:
-            context_parts.append(
-                f"--- From file: {chunk['file']} ---\n{chunk['content']}\n"
-            )
+            table_digest = self.documents[chunk['file_id']]['content_hash']
+            table = self.tables.get(table_digest)
+            if table is not None and table_digest in tables_used:
+                continue
+            if table is not None:
+                # Only the header and matching rows of a table go into the prompt
+                columns, rows = table.lookup(query, max_rows=TABLE_MAX_ROWS)
+                if len(rows):
+                    tables_used.add(table_digest)
+                    context_parts.append(
+                        f"--- From file: {self.file_label(chunk['file_ids'])} "
+                        f"(table, {len(rows)} of {table.row_count} rows) ---\n{table.to_csv(columns, rows)}\n"
+                    )
+                    continue
+            if 'sentences' in chunk:
+                passages = self.extract_passages(chunk, query_terms)
+            else:
+                passages = [(0, len(chunk['content']), chunk['content'])]
+            # Neighbouring chunks of a file overlap by CHUNK_OVERLAP; send each
+            # absolute character range of a content at most once
+            emitted_ranges = emitted.setdefault(table_digest, [])
+            for start, end, text in passages:
+                for piece_start, piece_end in _subtract_ranges(chunk['start'] + start, chunk['start'] + end, emitted_ranges):
+                    piece = chunk['content'][piece_start - chunk['start']:piece_end - chunk['start']]
+                    if not piece.strip():
+                        continue
+                    emitted_ranges.append((piece_start, piece_end))
+                    context_parts.append(
+                        f"--- From file: {self.file_label(chunk['file_ids'])} "
+                        f"(characters {piece_start}-{piece_end}) ---\n{piece}\n"
+                    )
         
         return "\n".join(context_parts)
     
+    def extract_passages(self, chunk: Dict, query_terms: set,
+                         max_chars: int = PASSAGE_MAX_CHARS,
+                         window: int = PASSAGE_WINDOW_SENTENCES,
+                         max_windows: int = None) -> List[tuple]:
+        """
+        Pick the sentence windows of a chunk that best match the query.
+        
+        Sentences are scored from the chunk's precomputed term positions, with
+        terms that occur in fewer sentences weighing more. The best sentences
+        are widened by window sentences on each side and merged until
+        max_chars is reached.
+        
+        Args:
+            chunk: Chunk, ideally with 'sentences' and 'term_sentences' from
+                index_sentences (computed on the fly otherwise)
+            query_terms: Lowercased query terms
+            max_chars: Character budget for this chunk's passages
+            window: Neighbouring sentences kept on each side of a match
+            max_windows: Stop after this many best-matching windows (default: no limit)
+        
+        Returns:
+            List of (start, end, text) passages in document order, with
+            offsets relative to the chunk
+        """
+        content = chunk['content']
+        if 'sentences' in chunk:
+            starts, term_sentences = chunk['sentences'], chunk['term_sentences']
+        else:
+            starts, term_sentences = index_sentences(content)
+        count = len(starts)
+        
+        scores = {}
+        for term in query_terms:
+            mask = term_sentences.get(term)
+            if not mask:
+                continue
+            weight = 1.0 / bin(mask).count('1')
+            while mask:
+                low = mask & -mask
+                i = low.bit_length() - 1
+                scores[i] = scores.get(i, 0.0) + weight
+                mask ^= low
+        if not scores:
+            return [(0, min(len(content), max_chars), content[:max_chars])]
+        
+        def bounds(first, last):
+            end = starts[last + 1] if last + 1 < count else len(content)
+            return starts[first], end
+        
+        # Greedily add windows around the best sentences within the budget
+        selected = set()
+        used = 0
+        windows = 0
+        for i in sorted(scores, key=lambda i: (-scores[i], i)):
+            window_ids = [j for j in range(max(0, i - window), min(count, i + window + 1)) if j not in selected]
+            added = sum(bounds(j, j)[1] - bounds(j, j)[0] for j in window_ids)
+            if used + added > max_chars and i not in selected:
+                # Over budget: drop the neighbours before the matching sentence
+                window_ids = [i]
+                added = bounds(i, i)[1] - bounds(i, i)[0]
+            if used and used + added > max_chars:
+                continue
+            selected.update(window_ids)
+            used += added
+            windows += 1
+            if used >= max_chars or windows == max_windows:
+                break
+        
+        # Merge consecutive sentences into passages
+        passages = []
+        run_start = prev = None
+        for j in sorted(selected):
+            if prev is not None and j == prev + 1:
+                prev = j
+                continue
+            if run_start is not None:
+                passages.append(bounds(run_start, prev))
+            run_start = prev = j
+        passages.append(bounds(run_start, prev))
+        
+        result = []
+        for start, end in passages:
+            # Keep the offsets in step with the stripped and cut text, so a
+            # citation covers exactly what is sent
+            text = content[start:end]
+            start += len(text) - len(text.lstrip())
+            end = start + len(text.strip())
+            if end - start > max_chars:
+                # A single sentence longer than the budget: cut around its first match
+                match = next((m.start() for m in TERM.finditer(content, start, end)
+                              if m.group(0).lower() in query_terms), start)
+                start = max(start, min(match - max_chars // 2, end - max_chars))
+                end = start + max_chars
+            result.append((start, end, content[start:end]))
+        return result
+    
+    def search(self, query: str, offset: int = 0, limit: int = 10,
+               file_ids: List[str] = None, mime_types: List[str] = None) -> Dict:
+        """
+        Rank chunks for a query without building a prompt.
+        
+        Args:
+            query: Search terms
+            offset: Number of ranked hits to skip (pagination)
+            limit: Maximum hits to return
+            file_ids: Only return chunks from these files
+            mime_types: Only return chunks from files with these MIME types
+                (a trailing '/' matches a whole family, e.g. 'text/')
+        
+        Returns:
+            {'total': matching chunk count, 'hits': [{'file_id', 'name',
+            'mime_type', 'score', 'start', 'end', 'snippet'}, ...]}
+        """
+        with timed('search'):
+            wanted_ids = set(file_ids) if file_ids else None
+            
+            def allowed(file_id):
+                if wanted_ids is not None and file_id not in wanted_ids:
+                    return False
+                if mime_types:
+                    mime_type = self.documents[file_id]['mime_type']
+                    return any(
+                        mime_type.startswith(m) if m.endswith('/') else mime_type == m
+                        for m in mime_types
+                    )
+                return True
+            
+            # Deduplicated chunks list every file sharing them; cite the first allowed one
+            candidates = []
+            for chunk in self.chunks:
+                file_id = next((f for f in chunk['file_ids'] if allowed(f)), None)
+                if file_id is not None:
+                    candidates.append((file_id, chunk))
+            cited = {id(chunk): file_id for file_id, chunk in candidates}
+            
+            ranked = self._score_chunks(query, [chunk for _, chunk in candidates])
+            query_terms = set(TERM.findall(query.lower()))
+            hits = []
+            for score, chunk in ranked[offset:offset + limit]:
+                file_id = cited[id(chunk)]
+                hits.append({
+                    'file_id': file_id,
+                    'name': self.documents[file_id]['name'],
+                    'also_in': [f for f in chunk['file_ids'] if f != file_id],
+                    'mime_type': self.documents[file_id]['mime_type'],
+                    'score': round(score, 4),
+                    'start': chunk['start'],
+                    'end': chunk['end'],
+                    'snippet': self._snippet(chunk, query_terms),
+                })
+            return {'total': len(ranked), 'hits': hits}
+    
+    def _snippet(self, chunk: Dict, query_terms: set, max_chars: int = 300) -> str:
+        """Best-matching sentence of a chunk, HTML-escaped, with query terms in <mark>."""
+        start, end, text = self.extract_passages(chunk, query_terms, max_chars=max_chars, window=0, max_windows=1)[0]
+        parts = []
+        last = 0
+        for m in TERM.finditer(text):
+            parts.append(html.escape(text[last:m.start()], quote=False))
+            word = html.escape(m.group(0), quote=False)
+            parts.append(f"<mark>{word}</mark>" if m.group(0).lower() in query_terms else word)
+            last = m.end()
+        parts.append(html.escape(text[last:], quote=False))
+        return ''.join(parts)
+    
     def get_all_content(self) -> str:
         """
         Get all document content (for small document sets).
         
+        Built once per loaded corpus and truncated to CORPUS_CONTEXT_LENGTH,
+        so repeated fallback queries reuse the same string.
+        
         Returns:
-            Combined content from all documents
+            Combined content from all documents, with duplicates included once
         """
-        content_parts = []
-        for file_name, content in self.documents.items():
-            content_parts.append(f"--- File: {file_name} ---\n{content}\n")
-        return "\n".join(content_parts)
-
+        if self._all_content is None:
+            content_parts = []
+            for digest, file_ids in self.content_files.items():
+                content = self.documents[file_ids[0]]['content']
+                content_parts.append(f"--- File: {self.file_label(file_ids)} ---\n{content}\n")
+            all_content = "\n".join(content_parts)
+            if len(all_content) > CORPUS_CONTEXT_LENGTH:
+                all_content = all_content[:CORPUS_CONTEXT_LENGTH] + "... [truncated]"
+            self._all_content = all_content
+        return self._all_content
@@ -0,0 +1,48 @@
+"""
+Client-side rate limiting for Gemini API calls.
+Spaces request starts to stay under a requests-per-minute quota and caps the
+number of calls in flight, so concurrent fan-out does not trip 429 errors.
+"""
+import threading
+import time
+
+
+class RateLimiter:
+    """Requests-per-minute pacing plus a concurrency cap; use as a context manager."""
+
+    def __init__(self, requests_per_minute: float = 0, max_concurrent: int = 0):
+        """
+        Args:
+            requests_per_minute: Maximum request starts per minute (0 = unlimited)
+            max_concurrent: Maximum calls in flight (0 = unlimited)
+        """
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may start."""
+        if self._slots is not None:
+            self._slots.acquire()
+        if self.interval:
+            # Reserve the next start slot, then wait for it outside the lock
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start)
+                self._next_start = start + self.interval
+            if start > now:
+                time.sleep(start - now)
+
+    def release(self):
+        """Mark a request as finished."""
+        if self._slots is not None:
+            self._slots.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
@@ -0,0 +1,99 @@
+"""
+Production server entry point.
+Loads the corpus and index once in the parent process, then forks gunicorn
+workers that share it copy-on-write. Falls back to a threaded single-process
+server where gunicorn is unavailable (e.g. Windows).
+
+Usage:
+    python serve.py --workers 4 --bind 0.0.0.0:8000
+"""
+import argparse
+import atexit
+import os
+import shutil
+import tempfile
+
+from config import (
+    SERVER_BIND, SERVER_WORKERS, SERVER_THREADS, SERVER_TIMEOUT,
+    ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, METRICS_MULTIPROC_DIR
+)
+from startup_profile import maybe_profile_startup
+
+
+def run_gunicorn(args):
+    """Serve with gunicorn, preloading the app in the master process."""
+    from gunicorn.app.base import BaseApplication
+    from metrics import enable_multiprocess
+
+    # Each worker keeps its own metrics; merge them so any worker's /metrics covers all
+    if METRICS_MULTIPROC_DIR:
+        enable_multiprocess(METRICS_MULTIPROC_DIR)
+    elif args.workers > 1:
+        metrics_dir = tempfile.mkdtemp(prefix='gdrive-gemini-metrics-')
+        master_pid = os.getpid()
+        # Workers run atexit hooks too; only the master removes the directory
+        atexit.register(lambda: os.getpid() == master_pid and shutil.rmtree(metrics_dir, ignore_errors=True))
+        enable_multiprocess(metrics_dir)
+    from app import create_app
+
+    class PreloadedApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', args.bind)
+            self.cfg.set('workers', args.workers)
+            self.cfg.set('threads', args.threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('timeout', args.timeout)
+            self.cfg.set('preload_app', True)
+
+        def load(self):
+            return create_app(preload=True)
+
+    PreloadedApplication().run()
+
+
+def run_threaded(args):
+    """Serve from one process with a thread per request."""
+    from werkzeug.serving import run_simple
+    from app import create_app
+
+    host, _, port = args.bind.rpartition(':')
+    flask_app = create_app(preload=True)
+    print(f"Serving on http://{args.bind} (single process, threaded)")
+    run_simple(host or '0.0.0.0', int(port), flask_app, threaded=True)
+
+
+def main(argv=None):
+    maybe_profile_startup('app')
+    parser = argparse.ArgumentParser(description="Run the connector API with a preloaded corpus.")
+    parser.add_argument('--bind', default=SERVER_BIND, help="host:port to listen on")
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help="Worker processes (gunicorn)")
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS, help="Threads per worker (gunicorn)")
+    parser.add_argument('--timeout', type=int, default=SERVER_TIMEOUT, help="Worker timeout in seconds (gunicorn)")
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'threaded'], default='auto',
+                        help="Server implementation (auto uses gunicorn when installed)")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="Print an import-time breakdown of the app and exit")
+    args = parser.parse_args(argv)
+
+    server = args.server
+    if server == 'auto':
+        try:
+            import gunicorn  # noqa: F401
+            server = 'gunicorn'
+        except ImportError:
+            server = 'threaded'
+
+    if server == 'gunicorn':
+        if ADMISSION_MAX_CONCURRENT > 0 and args.threads <= ADMISSION_MAX_CONCURRENT + ADMISSION_MAX_QUEUE:
+            # Requests beyond the thread count wait in gunicorn's backlog, where
+            # admission control cannot see, queue or shed them
+            print(f"⚠️  --threads {args.threads} does not exceed admission slots + queue "
+                  f"({ADMISSION_MAX_CONCURRENT} + {ADMISSION_MAX_QUEUE}); overload will queue "
+                  f"in gunicorn without deadlines instead of being shed with 429")
+        run_gunicorn(args)
+    else:
+        run_threaded(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Single-flight coalescing of identical concurrent calls.
+The first caller for a key runs the function; callers arriving while it is in
+flight wait for and share its result instead of repeating the work.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Call:
+    """An in-flight call and its outcome."""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls by key. Results are not kept once the call finishes."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any],
+           timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Run fn once for all concurrent callers with the same key.
+
+        Args:
+            key: Identity of the work (callers with equal keys share one call)
+            fn: Function to run if no call for key is in flight
+            timeout: Longest a caller joining an in-flight call waits for it
+                (the caller running fn is not limited)
+
+        Returns:
+            (result, shared) where shared is True if this caller reused another
+            caller's in-flight result. Exceptions raised by fn propagate to
+            every caller.
+
+        Raises:
+            TimeoutError: The in-flight call did not finish within timeout
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self._lock:
+                    call.waiters -= 1
+                raise TimeoutError('timed out waiting for an identical in-flight call')
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self) -> int:
+        """Number of distinct calls currently running."""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,63 @@
+"""
+Import-time profiling for the command-line entry points.
+Run any entry point with --profile-startup (or PROFILE_STARTUP=1) to print a
+breakdown of where its import time goes instead of running it.
+"""
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+FLAG = '--profile-startup'
+
+
+def profile_imports(module: str) -> Tuple[int, List[Tuple[str, int, int]]]:
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    Args:
+        module: Module name to import
+
+    Returns:
+        (total microseconds, list of (module, self_us, cumulative_us))
+    """
+    env = {k: v for k, v in os.environ.items() if k != 'PROFILE_STARTUP'}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env=env
+    )
+    entries = []
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        name = name.strip()
+        entries.append((name, int(self_us), int(cumulative_us)))
+        if name == module:
+            total = int(cumulative_us)
+    return total, entries
+
+
+def print_breakdown(module: str, top: int = 15):
+    """Print total import time and the most expensive top-level packages."""
+    total, entries = profile_imports(module)
+    by_package: Dict[str, int] = defaultdict(int)
+    for name, self_us, _ in entries:
+        by_package[name.split('.')[0]] += self_us
+
+    print("=" * 60)
+    print(f"Import-time breakdown for '{module}': {total / 1000:.1f} ms")
+    print("=" * 60)
+    for package, self_us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]:
+        share = self_us / total if total else 0.0
+        print(f"  {self_us / 1000:8.1f} ms  {share:6.1%}  {package}")
+    print("=" * 60)
+
+
+def maybe_profile_startup(module: str):
+    """Print the import breakdown and exit if startup profiling was requested."""
+    if FLAG in sys.argv or os.getenv('PROFILE_STARTUP', '').lower() in ('1', 'true', 'yes'):
+        print_breakdown(module)
+        sys.exit(0)
@@ -0,0 +1,155 @@
+"""
+Columnar in-memory store for tabular documents (CSV files and exported Sheets).
+Each column is dictionary-encoded (integer codes into its distinct values) with
+a word index over those values, and numeric columns also keep a float array.
+Lookups select rows with vectorized NumPy operations, so a prompt can carry
+just the header and the matching rows.
+"""
+import csv
+import io
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+TERM = re.compile(r'\w+')
+
+
+def _to_float(value: str) -> float:
+    """Parse a numeric cell (allowing thousands separators and currency/percent signs)."""
+    cleaned = value.strip().replace(',', '').lstrip('$€£').rstrip('%')
+    return float(cleaned) if cleaned else float('nan')
+
+
+class Column:
+    """One dictionary-encoded column."""
+
+    __slots__ = ('name', 'codes', 'values', 'term_values', 'numbers')
+
+    def __init__(self, name: str, cells: List[str]):
+        self.name = name
+        distinct, codes = np.unique(np.array(cells, dtype=object), return_inverse=True)
+        self.codes = codes.astype(np.int32)
+        # Original cell text, for rebuilding rows
+        self.values = distinct
+        # Lowercased word -> codes of the distinct values containing it
+        term_values: Dict[str, List[int]] = {}
+        for code, value in enumerate(distinct):
+            for term in set(TERM.findall(str(value).lower())):
+                term_values.setdefault(term, []).append(code)
+        self.term_values = {term: np.array(c, dtype=np.int32) for term, c in term_values.items()}
+        # Typed view when every non-empty cell is a number
+        self.numbers = None
+        try:
+            self.numbers = np.array([_to_float(str(v)) for v in distinct], dtype=np.float64)[self.codes]
+        except ValueError:
+            pass
+
+    def contains(self, term: str) -> Optional[np.ndarray]:
+        """Boolean row mask of text cells containing the word, or None if no cell does."""
+        codes = self.term_values.get(term)
+        if codes is None or self.numbers is not None:
+            # Numeric columns are matched by value (equals), not by digits as words
+            return None
+        return np.isin(self.codes, codes)
+
+    def equals(self, number: float) -> Optional[np.ndarray]:
+        """Boolean row mask of numeric cells equal to number, or None for text columns."""
+        if self.numbers is None:
+            return None
+        return self.numbers == number
+
+    def cell(self, row: int) -> str:
+        return str(self.values[self.codes[row]])
+
+
+class Table:
+    """A parsed table with a header index and dictionary-encoded columns."""
+
+    def __init__(self, header: List[str], rows: List[List[str]]):
+        self.header = header
+        self.width = len(header)
+        self.row_count = len(rows)
+        self.columns = [
+            Column(name, [row[i] if i < len(row) else '' for row in rows])
+            for i, name in enumerate(header)
+        ]
+        # Lowercased header words -> column indices
+        self.header_index: Dict[str, List[int]] = {}
+        for i, name in enumerate(header):
+            for term in set(TERM.findall(name.lower())):
+                self.header_index.setdefault(term, []).append(i)
+
+    def lookup(self, query: str, max_rows: int = 50) -> Tuple[List[int], np.ndarray]:
+        """
+        Find the columns and rows a query refers to.
+
+        Rows are ranked by how many query words or numbers their cells contain.
+        If no cell matches but query words name columns (e.g. "total revenue"),
+        those columns are returned for the first max_rows rows instead.
+
+        Args:
+            query: User query
+            max_rows: Maximum rows to return
+
+        Returns:
+            (column indices, row indices); empty rows if nothing matches
+        """
+        words = TERM.findall(query.lower())
+        numbers = []
+        for word in re.findall(r'-?\d[\d,]*\.?\d*', query):
+            try:
+                numbers.append(_to_float(word))
+            except ValueError:
+                continue
+        # Words that name a column select it rather than rows
+        named_columns = sorted({i for w in words for i in self.header_index.get(w, [])})
+        cell_terms = [w for w in words if w not in self.header_index]
+
+        scores = np.zeros(self.row_count, dtype=np.int32)
+        for needle, method in [(t, Column.contains) for t in cell_terms] + [(n, Column.equals) for n in numbers]:
+            mask = np.zeros(self.row_count, dtype=bool)
+            for column in self.columns:
+                column_mask = method(column, needle)
+                if column_mask is not None:
+                    mask |= column_mask
+            # Words found in most rows ("the", a shared status value) do not select anything
+            if self.row_count >= 4 and mask.sum() > self.row_count // 2:
+                continue
+            scores += mask
+
+        if scores.any():
+            matched = np.flatnonzero(scores)
+            # Highest scores first, ties in table order
+            order = np.argsort(-scores[matched], kind='stable')
+            return list(range(self.width)), np.sort(matched[order][:max_rows])
+        if named_columns:
+            return named_columns, np.arange(min(self.row_count, max_rows))
+        return [], np.array([], dtype=np.int64)
+
+    def to_csv(self, columns: List[int], rows: np.ndarray) -> str:
+        """Render the header and the given rows/columns as CSV."""
+        out = io.StringIO()
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow([self.header[i] for i in columns])
+        for row in rows:
+            writer.writerow([self.columns[i].cell(int(row)) for i in columns])
+        return out.getvalue()
+
+
+def parse_table(text: str) -> Optional[Table]:
+    """
+    Parse CSV text into a Table.
+
+    Returns:
+        The table, or None if the text does not look like a table with a
+        header and at least one data row of two or more columns
+    """
+    try:
+        rows = [row for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+    except csv.Error:
+        return None
+    if len(rows) < 2 or len(rows[0]) < 2:
+        return None
+    header = [cell.strip() or f"column_{i + 1}" for i, cell in enumerate(rows[0])]
+    return Table(header, rows[1:])
@@ -0,0 +1,9 @@
+"""
+WSGI entry point for external servers.
+Load it in the parent process so workers share the preloaded corpus, e.g.:
+
+    gunicorn --preload -w 4 -k gthread --threads 76 wsgi:application
+"""
+from app import create_app
+
+application = create_app(preload=True)